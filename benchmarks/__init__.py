@@ -0,0 +1 @@
+"""Offline benchmarks of nonutils, run with `python -m benchmarks`."""
@@ -0,0 +1,59 @@
+"""Run the benchmarks and print the results as JSON.
+
+```
+python -m benchmarks [--quick] [--only import,dispatch,api,preference] [--output results.json]
+```
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+
+import nonebot
+from nonebot.log import logger, default_filter, default_format
+
+BENCHMARKS = ('import', 'dispatch', 'api', 'preference')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    parser.add_argument('--quick', action='store_true', help='smaller sizes, for a quick check')
+    parser.add_argument('--only', default=','.join(BENCHMARKS), help='comma separated benchmarks to run')
+    parser.add_argument('--output', help='write results to this file instead of stdout')
+    args = parser.parse_args()
+
+    names = [name for name in args.only.split(',') if name]
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark: {name}")
+
+    # Keep stdout for the report
+    logger.remove()
+    logger.add(sys.stderr, level=0, diagnose=False, filter=default_filter, format=default_format)
+    # `nonutils` needs an initialized NoneBot, but no real driver
+    nonebot.init(driver='~none', log_level='WARNING')
+    import importlib
+
+    results = []
+    for name in names:
+        module = importlib.import_module(f'benchmarks.bench_{name}')
+        print(f"Running {name}...", file=sys.stderr)
+        results.extend(module.run(quick=args.quick))
+
+    report = json.dumps({
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'quick': args.quick,
+        'benchmarks': results,
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""`API.get` / `API.post` latency against a local aiohttp stub server."""
+import asyncio
+import statistics
+import time
+from typing import Any, Dict, List
+
+from aiohttp import web
+
+from nonutils.apimgr import API, apimgr
+
+
+class _SilentCmd:
+    """Stands in for a `Command`, swallowing failure replies."""
+
+    def __init__(self):
+        self.failures = 0
+
+    async def send_failure(self, message, **kwargs):
+        self.failures += 1
+
+
+class _StubApi(API):
+    async def test(self) -> bool:
+        return True
+
+
+async def _ok(request: web.Request) -> web.Response:
+    return web.json_response({'ok': True, 'items': list(range(32))})
+
+
+async def _echo(request: web.Request) -> web.Response:
+    # `API.post` sends form data
+    return web.json_response(dict(await request.post()))
+
+
+async def _slow(request: web.Request) -> web.Response:
+    await asyncio.sleep(1.)
+    return web.json_response({})
+
+
+async def _error(request: web.Request) -> web.Response:
+    return web.Response(status=500)
+
+
+async def _start_server() -> web.AppRunner:
+    app = web.Application()
+    app.add_routes([web.get('/ok', _ok), web.post('/echo', _echo),
+                    web.get('/slow', _slow), web.get('/error', _error)])
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', 0).start()
+    return runner
+
+
+def _summarize(samples: List[float]) -> Dict[str, float]:
+    samples = sorted(samples)
+    return {
+        'mean_ms': statistics.mean(samples) * 1e3,
+        'p50_ms': samples[len(samples) // 2] * 1e3,
+        'p95_ms': samples[int(len(samples) * .95)] * 1e3,
+        'max_ms': samples[-1] * 1e3,
+    }
+
+
+async def _measure(api: API, method: str, n_calls: int) -> Dict[str, Any]:
+    cmd = _SilentCmd()
+    samples = []
+    for i in range(n_calls):
+        start = time.perf_counter()
+        if method == 'GET':
+            await api.get(cmd)
+        else:
+            await api.post(cmd, {'i': i})
+        samples.append(time.perf_counter() - start)
+    results = _summarize(samples)
+    results['failures'] = cmd.failures
+    return results
+
+
+async def _run(n_calls: int) -> List[Dict[str, Any]]:
+    runner = await _start_server()
+    base = 'http://127.0.0.1:{}'.format(runner.addresses[0][1])
+    # Disable the breaker so the error case keeps hitting the server
+    cases = [
+        ('get', 'GET', _StubApi(base + '/ok', proxy=None)),
+        ('post', 'POST', _StubApi(base + '/echo', proxy=None)),
+        ('timeout', 'GET', _StubApi(base + '/slow', proxy=None, timeout=.05, failure_threshold=1 << 30)),
+        ('error', 'GET', _StubApi(base + '/error', proxy=None, failure_threshold=1 << 30)),
+    ]
+    try:
+        out = []
+        for case, method, api in cases:
+            # Slow cases are bounded by the timeout, so fewer calls are enough
+            n = n_calls if case in ('get', 'post') else max(n_calls // 10, 5)
+            out.append({
+                'name': 'api',
+                'params': {'case': case, 'method': method, 'calls': n},
+                'results': await _measure(api, method, n),
+            })
+        return out
+    finally:
+        await apimgr.close()
+        await runner.cleanup()
+
+
+def run(quick: bool = False) -> List[Dict[str, Any]]:
+    return asyncio.run(_run(50 if quick else 500))
@@ -0,0 +1,96 @@
+"""Event throughput through commands and switches registered by `CmdManager`."""
+import asyncio
+import random
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+from nonebot.matcher import Matcher, matchers
+from nonebot.message import handle_event
+from nonebot.rule import TrieRule
+
+import nonutils.command
+import nonutils.persistent
+from nonutils.command import CmdManager, Command, CommandWithSwitch
+
+from benchmarks.fake import FakeEvent, make_bot
+
+
+async def _setup(n_cmds: int, use_dispatcher: bool, deferred: bool) -> List[str]:
+    # Start from an empty registry for every size
+    matchers.clear()
+    TrieRule.prefix.clear()
+    cmdmgr = nonutils.command.cmdmgr = CmdManager()
+    if use_dispatcher:
+        cmdmgr.use_dispatcher()
+    if deferred:
+        cmdmgr.defer_registration()
+
+    texts = []
+    for i in range(n_cmds):
+        if i % 10:
+            cmd = Command(f'cmd{i}')
+            cmd.handle()(_reply)
+            texts.append(f'/cmd{i} arg')
+        else:
+            cmd = CommandWithSwitch(f'sw{i}')
+            for switch in ('on', 'off'):
+                cmd.new_switch(switch).matcher.handle()(_reply)
+                texts.append(f'/sw{i} {switch}')
+    # What the startup hook does
+    await cmdmgr.register_pending()
+    return texts
+
+
+async def _reply(matcher: Matcher):
+    await matcher.send('ok')
+
+
+async def _run(n_cmds: int, use_dispatcher: bool, deferred: bool,
+               n_events: int, budget: float) -> Dict[str, Any]:
+    start = time.perf_counter()
+    texts = await _setup(n_cmds, use_dispatcher, deferred)
+    setup_time = time.perf_counter() - start
+
+    bot = make_bot()
+    rng = random.Random(n_cmds)
+    events = [FakeEvent(text=rng.choice(texts)) for _ in range(n_events)]
+
+    # Without the dispatcher every event is matched against every command,
+    # so large sizes stop after `budget` seconds instead of handling all events
+    handled = 0
+    start = time.perf_counter()
+    for event in events:
+        await handle_event(bot, event)
+        handled += 1
+        if time.perf_counter() - start > budget:
+            break
+    elapsed = time.perf_counter() - start
+
+    return {
+        'name': 'dispatch',
+        'params': {'commands': n_cmds, 'dispatcher': use_dispatcher, 'deferred': deferred, 'events': handled},
+        'results': {
+            'setup_sec': setup_time,
+            'events_per_sec': handled / elapsed,
+            'us_per_event': elapsed / handled * 1e6,
+            'replies': bot.sent,
+        },
+    }
+
+
+def run(quick: bool = False) -> List[Dict[str, Any]]:
+    sizes = (10, 100, 1000) if quick else (10, 100, 1000, 10000)
+    n_events, budget = (200, 2.) if quick else (1000, 10.)
+    modes = ((False, False), (True, False), (True, True))
+    # Access control and the other preferences loaded by commands are saved here instead of the working directory
+    old_pref_dir = nonutils.persistent.pref_dir
+    with tempfile.TemporaryDirectory() as tmp:
+        nonutils.persistent.pref_dir = Path(tmp)
+        try:
+            return [asyncio.run(_run(n, use_dispatcher, deferred, n_events, budget))
+                    for n in sizes for use_dispatcher, deferred in modes]
+        finally:
+            nonutils.persistent.pref_writer.flush()
+            nonutils.persistent.pref_dir = old_pref_dir
@@ -0,0 +1,51 @@
+"""Import time of `nonutils`, as reported by `python -X importtime` in a fresh interpreter."""
+import re
+import subprocess
+import sys
+from typing import Any, Dict, List
+
+MODULES = ('nonutils.command', 'nonutils.apimgr', 'nonutils.persistent', 'nonutils.database',
+           'nonutils.internal_services.usage', 'nonutils.internal_services.stats')
+
+_SCRIPT = """
+import nonebot
+nonebot.init(driver='~none', log_level='WARNING')
+import sys, time
+sys.stderr.write('{marker}\\n')
+start = time.perf_counter()
+{imports}
+print(time.perf_counter() - start)
+"""
+
+_MARKER = '-- nonutils --'
+_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+
+def _measure() -> Dict[str, Any]:
+    script = _SCRIPT.format(marker=_MARKER, imports='\n'.join(f'import {m}' for m in MODULES))
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', script],
+                          capture_output=True, text=True, check=True)
+    # Only modules imported after `nonebot.init`, i.e. by `nonutils`
+    lines = proc.stderr.splitlines()
+    modules = {}
+    for line in lines[lines.index(_MARKER) + 1:]:
+        match = _LINE.match(line)
+        if match:
+            modules[match.group(4)] = (int(match.group(1)), int(match.group(2)), len(match.group(3)) // 2)
+    return {'total_sec': float(proc.stdout.split()[-1]), 'modules': modules}
+
+
+def run(quick: bool = False) -> List[Dict[str, Any]]:
+    report = _measure()
+    out = [{
+        'name': 'import',
+        'params': {'module': 'total'},
+        'results': {'sec': report['total_sec']},
+    }]
+    for name, (self_us, cumulative_us, depth) in sorted(report['modules'].items(), key=lambda i: -i[1][0])[:20]:
+        out.append({
+            'name': 'import',
+            'params': {'module': name},
+            'results': {'self_us': self_us, 'cumulative_us': cumulative_us, 'depth': depth},
+        })
+    return out
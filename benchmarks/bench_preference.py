@@ -0,0 +1,69 @@
+"""Write throughput of `Preference` and `ScopedPreferenceStore`."""
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import nonutils.persistent
+from nonutils.persistent import Preference, ScopedPreference, ScopedPreferenceStore
+
+
+class _BenchPref(Preference):
+    counter: int = 0
+    items: Dict[str, int] = {}
+
+
+class _BenchScopedPref(ScopedPreference):
+    counter: int = 0
+
+
+def _result(params: Dict[str, Any], n_ops: int, elapsed: float) -> Dict[str, Any]:
+    return {
+        'name': 'preference',
+        'params': params,
+        'results': {'ops_per_sec': n_ops / elapsed, 'us_per_op': elapsed / n_ops * 1e6},
+    }
+
+
+def _bench_setattr(n_ops: int, n_keys: int) -> Dict[str, Any]:
+    pref = _BenchPref('bench', items={str(i): i for i in range(n_keys)})
+    pref.flush()
+    start = time.perf_counter()
+    for i in range(n_ops):
+        pref.counter = i
+    # Include the debounced write, so the number is what actually reaches the disk
+    pref.flush()
+    return _result({'case': 'setattr', 'keys': n_keys, 'ops': n_ops}, n_ops, time.perf_counter() - start)
+
+
+def _bench_flush(n_ops: int, n_keys: int) -> Dict[str, Any]:
+    pref = _BenchPref('bench', items={str(i): i for i in range(n_keys)})
+    start = time.perf_counter()
+    for i in range(n_ops):
+        pref.counter = i
+        pref.flush()
+    return _result({'case': 'flush', 'keys': n_keys, 'ops': n_ops}, n_ops, time.perf_counter() - start)
+
+
+def _bench_scoped(n_ops: int, n_scopes: int) -> Dict[str, Any]:
+    store = ScopedPreferenceStore(_BenchScopedPref, 'bench', flush_delay=60.)
+    start = time.perf_counter()
+    for i in range(n_ops):
+        store[str(i % n_scopes)].counter = i
+    store.flush()
+    return _result({'case': 'scoped', 'scopes': n_scopes, 'ops': n_ops}, n_ops, time.perf_counter() - start)
+
+
+def run(quick: bool = False) -> List[Dict[str, Any]]:
+    n_ops = 1000 if quick else 10000
+    old_pref_dir = nonutils.persistent.pref_dir
+    with tempfile.TemporaryDirectory() as tmp:
+        nonutils.persistent.pref_dir = Path(tmp)
+        try:
+            return [
+                *(_bench_setattr(n_ops, n_keys) for n_keys in (10, 1000)),
+                *(_bench_flush(n_ops // 10, n_keys) for n_keys in (10, 1000)),
+                *(_bench_scoped(n_ops, n_scopes) for n_scopes in (10, 1000)),
+            ]
+        finally:
+            nonutils.persistent.pref_dir = old_pref_dir
@@ -0,0 +1,76 @@
+"""Minimal in-memory adapter, so events can be fed to nonebot without any network."""
+from typing import Iterable, Optional
+
+import nonebot
+from nonebot.adapters import Adapter, Bot, Event, Message, MessageSegment
+
+
+class FakeMessageSegment(MessageSegment):
+    @classmethod
+    def get_message_class(cls):
+        return FakeMessage
+
+    def __str__(self) -> str:
+        return self.data['text'] if self.is_text() else f'[{self.type}]'
+
+    def is_text(self) -> bool:
+        return self.type == 'text'
+
+
+class FakeMessage(Message):
+    @classmethod
+    def get_segment_class(cls):
+        return FakeMessageSegment
+
+    @staticmethod
+    def _construct(msg: str) -> Iterable[FakeMessageSegment]:
+        yield FakeMessageSegment('text', {'text': msg})
+
+
+class FakeEvent(Event):
+    text: str
+    user_id: str = 'user'
+    group_id: Optional[str] = None
+
+    def get_type(self) -> str:
+        return 'message'
+
+    def get_event_name(self) -> str:
+        return 'message'
+
+    def get_event_description(self) -> str:
+        return self.text
+
+    def get_user_id(self) -> str:
+        return self.user_id
+
+    def get_session_id(self) -> str:
+        return f'{self.group_id}_{self.user_id}'
+
+    def get_message(self) -> FakeMessage:
+        return FakeMessage(self.text)
+
+    def is_tome(self) -> bool:
+        return True
+
+
+class FakeAdapter(Adapter):
+    @classmethod
+    def get_name(cls) -> str:
+        return 'fake'
+
+    async def _call_api(self, bot: Bot, api: str, **data):
+        return None
+
+
+class FakeBot(Bot):
+    def __init__(self, adapter: Adapter, self_id: str):
+        super().__init__(adapter, self_id)
+        self.sent = 0
+
+    async def send(self, event: Event, message, **kwargs):
+        self.sent += 1
+
+
+def make_bot() -> FakeBot:
+    return FakeBot(FakeAdapter(nonebot.get_driver()), 'bot')
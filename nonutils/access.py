@@ -0,0 +1,89 @@
+from typing import Dict, List, Optional
+
+from nonebot.adapters import Event
+
+from nonutils.persistent import Preference
+
+
+class AccessPreference(Preference):
+    # scope -> names of the commands and switches disabled in it
+    disabled: Dict[str, List[str]] = {}
+
+
+def group_scope(group_id) -> str:
+    return f'group_{group_id}'
+
+
+def user_scope(user_id) -> str:
+    return f'user_{user_id}'
+
+
+class AccessControl:
+    """Enable and disable commands and switches per group and per user.
+
+    Every command name gets a bit, and every scope a bitset of the commands disabled in it,
+    so checking an event is two dict lookups and a bitwise and, whatever the number of commands or scopes.
+    Disabled names are saved in the `access` preference, and bits are assigned by name on first use,
+    so they stay valid whether a name is disabled before or after its command is registered.
+    """
+
+    def __init__(self, pref_name: str = 'access'):
+        self.pref_name = pref_name
+
+        self._ids: Dict[str, int] = {}
+        self._masks: Dict[str, int] = {}
+        self._pref: Optional[AccessPreference] = None
+
+    def get_bit(self, name: str) -> int:
+        if name not in self._ids:
+            self._ids[name] = len(self._ids)
+        return 1 << self._ids[name]
+
+    def load(self) -> AccessPreference:
+        """Load the disabled names from the preference on first use."""
+        if self._pref is None:
+            self._pref = AccessPreference(self.pref_name)
+            for scope, names in self._pref.disabled.items():
+                for name in names:
+                    self._masks[scope] = self._masks.get(scope, 0) | self.get_bit(name)
+        return self._pref
+
+    def is_allowed(self, bits: int, event: Event) -> bool:
+        """Check whether none of `bits` is disabled for the group or the user of `event`."""
+        self.load()
+        masks = self._masks
+        if not masks:
+            return True
+
+        group_id = getattr(event, 'group_id', None)
+        if group_id is not None and masks.get(group_scope(group_id), 0) & bits:
+            return False
+        try:
+            user_id = event.get_user_id()
+        except Exception:
+            return True
+        return not masks.get(user_scope(user_id), 0) & bits
+
+    def set_enabled(self, name: str, scope: str, enabled: bool) -> None:
+        """Enable or disable command `name` (`"cmd switch"` for switches) in `scope`,
+        see `group_scope` and `user_scope`."""
+        pref = self.load()
+        names = pref.disabled.setdefault(scope, [])
+        bit = self.get_bit(name)
+
+        if enabled and name in names:
+            names.remove(name)
+            self._masks[scope] = self._masks.get(scope, 0) & ~bit
+        elif not enabled and name not in names:
+            names.append(name)
+            self._masks[scope] = self._masks.get(scope, 0) | bit
+        else:
+            return
+
+        if not names:
+            del pref.disabled[scope]
+            self._masks.pop(scope, None)
+        pref._mark_dirty()
+
+
+accessctl = AccessControl()
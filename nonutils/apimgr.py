@@ -1,13 +1,35 @@
 import asyncio
+import copy
 import json
+import random
 from abc import abstractmethod
-from typing import Set, Optional
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from tempfile import SpooledTemporaryFile
+import time
+from collections import defaultdict, deque
+from typing import Set, Optional, Dict, Tuple, Any, Hashable, AsyncIterator, Iterable, Union, NamedTuple, \
+    TYPE_CHECKING
+from urllib.parse import urlsplit
 from urllib.request import getproxies
 
-import aiohttp
 from loguru import logger
+from nonebot import get_driver
 
+from nonutils import fastjson
+from nonutils.breaker import CircuitBreaker
+from nonutils.cache import ResponseCache
 from nonutils.command import Command
+from nonutils.metrics import metrics
+from nonutils.ratelimit import TokenBucket
+from nonutils.tracing import tracer
+
+if TYPE_CHECKING:
+    import aiohttp
+
+
+# Set while `API.test()` runs for a health check, so its requests get through an open breaker
+_probing: ContextVar[bool] = ContextVar('nonutils_api_probing', default=False)
 
 
 def get_sys_proxy():
@@ -18,68 +40,478 @@ def get_sys_proxy():
 
 
 class ApiManager:
-    def __init__(self):
+    def __init__(self, limit_per_host: int = 10, keepalive_timeout: float = 30.,
+                 health_check_interval: float = 60., health_check_jitter: float = 5.):
         self.apis: Set[API] = set()
 
+        self.health_check_interval = health_check_interval
+        self.health_check_jitter = health_check_jitter
+        self._health_check_task: Optional[asyncio.Future] = None
+
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.host_limits: Dict[str, int] = {}
+        self.host_buckets: Dict[str, TokenBucket] = {}
+
+        # One long-lived session per (host, proxy), shared by all APIs on that host
+        self._sessions: Dict[Tuple[str, Optional[str]], 'aiohttp.ClientSession'] = {}
+
+    def set_host_limit(self, host: str, limit: int) -> None:
+        """Set the max number of connections to `host`, applied to sessions created afterwards."""
+        self.host_limits[host] = limit
+
+    def get_session(self, url: str, proxy: Optional[str] = None) -> 'aiohttp.ClientSession':
+        # aiohttp is slow to import, so it is only imported once the first request is made
+        import aiohttp
+
+        host = urlsplit(url).netloc
+        session = self._sessions.get((host, proxy))
+        if session is None or session.closed:
+            limit = self.host_limits.get(host, self.limit_per_host)
+            connector = aiohttp.TCPConnector(limit=limit, limit_per_host=limit,
+                                             keepalive_timeout=self.keepalive_timeout)
+            session = aiohttp.ClientSession(connector=connector)
+            self._sessions[(host, proxy)] = session
+            logger.debug(f"Created API session: host={host}, proxy={proxy}, limit={limit}")
+        return session
+
+    def get_host_bucket(self, host: str, cooldown: float, burst: int = 1) -> TokenBucket:
+        """Get the rate limiter shared by all APIs on `host`, created by the first API asking for it."""
+        if host not in self.host_buckets:
+            self.host_buckets[host] = TokenBucket(1 / cooldown, burst)
+        return self.host_buckets[host]
+
+    def get_pool_stats(self) -> Dict[str, Dict[str, int]]:
+        stats = {}
+        for (host, proxy), session in self._sessions.items():
+            if session.closed:
+                continue
+            connector = session.connector
+            stats[host if proxy is None else f"{host} via {proxy}"] = {
+                'limit': connector.limit,
+                # aiohttp does not expose these publicly
+                'acquired': len(connector._acquired),
+                'idle': sum(len(conns) for conns in connector._conns.values()),
+            }
+        return stats
+
+    def get_cache_stats(self) -> Dict[str, Dict[str, int]]:
+        return {api.url: api.cache.get_stats() for api in self.apis if api.cache is not None}
+
+    async def fan_out(self, calls: Iterable[Union['API', Tuple['API', Optional[dict]]]],
+                      limit: int = 16, limit_per_host: int = 4,
+                      deadline: Optional[float] = None) -> AsyncIterator['ApiResult']:
+        """Call many APIs concurrently, yielding results in completion order.
+
+        参数:
+            calls: `API` for a GET call, or `(API, data)` for a POST call (GET if `data` is None)
+            limit: max number of concurrent calls in the batch
+            limit_per_host: max number of concurrent calls to the same host
+            deadline: seconds for the whole batch, unfinished calls are cancelled and
+                      yielded with an `asyncio.TimeoutError`
+        """
+        batch_sem = asyncio.Semaphore(limit)
+        host_sems: Dict[str, asyncio.Semaphore] = defaultdict(lambda: asyncio.Semaphore(limit_per_host))
+
+        async def run(api: API, data: Optional[dict]) -> ApiResult:
+            # Waiting for a busy host must not hold a batch slot other hosts could use
+            async with host_sems[urlsplit(api.url).netloc], batch_sem:
+                try:
+                    return ApiResult(api, data, await api.request('GET' if data is None else 'POST', data), None)
+                except Exception as e:
+                    return ApiResult(api, data, None, e)
+
+        tasks: Dict[asyncio.Future, Tuple[API, Optional[dict]]] = {}
+        for call in calls:
+            api, data = (call, None) if isinstance(call, API) else call
+            tasks[asyncio.ensure_future(run(api, data))] = (api, data)
+
+        loop = asyncio.get_event_loop()
+        end_at = None if deadline is None else loop.time() + deadline
+        pending = set(tasks)
+        try:
+            while pending:
+                timeout = None if end_at is None else end_at - loop.time()
+                if timeout is not None and timeout <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+        for task in pending:
+            api, data = tasks[task]
+            yield ApiResult(api, data, None, asyncio.TimeoutError())
+
+    async def _probe(self, api: 'API') -> None:
+        await asyncio.sleep(random.uniform(0, self.health_check_jitter))
+        token = _probing.set(True)
+        try:
+            ok = await asyncio.wait_for(api.test(), api.timeout)
+        except (NotImplementedError, ApiUnavailableError):
+            # Not testable, or disabled by hand, which says nothing about the server
+            return
+        except Exception as e:
+            logger.warning(f"Test API failed: {api.url}, {e!r}")
+            ok = False
+        finally:
+            _probing.reset(token)
+
+        if ok:
+            if api.breaker.state != CircuitBreaker.CLOSED:
+                logger.info(f"API recovered: {api.url}")
+            api.breaker.record_success()
+        else:
+            api.breaker.record_failure()
+
+    async def check_health(self) -> None:
+        """Run `API.test()` for all APIs concurrently and update their breakers."""
+        await asyncio.gather(*(self._probe(api) for api in self.apis))
+
+    async def _health_check_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            await self.check_health()
+
+    async def start_health_check(self) -> None:
+        # Async, so nonebot runs it on the event loop instead of a worker thread
+        if self.health_check_interval > 0 and self._health_check_task is None:
+            self._health_check_task = asyncio.get_running_loop().create_task(self._health_check_loop())
+
+    def stop_health_check(self) -> None:
+        if self._health_check_task is not None:
+            self._health_check_task.cancel()
+            self._health_check_task = None
+
+    async def close(self) -> None:
+        self.stop_health_check()
+
+        sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            await session.close()
+        logger.debug(f"Closed {len(sessions)} API session(s)")
+
 
 apimgr = ApiManager()
 
+try:
+    get_driver().on_startup(apimgr.start_health_check)
+    get_driver().on_shutdown(apimgr.close)
+except ValueError:
+    logger.warning("NoneBot is not initialized, API sessions will not be closed on shutdown")
+
 
 class ApiMetaClass(type):
     def __new__(mcs, name, bases, attrs):
         return type.__new__(mcs, name, bases, attrs)
 
 
+class ApiStatusError(Exception):
+    def __init__(self, url: str, status: int):
+        super().__init__(f"{url} responded with status {status}")
+        self.url = url
+        self.status = status
+
+    @property
+    def transient(self) -> bool:
+        """Whether the server is failing or throttling, rather than rejecting this request."""
+        return self.status >= 500 or self.status == 429
+
+
+class ApiUnavailableError(Exception):
+    def __init__(self, url: str):
+        super().__init__(f"{url} is disabled or its circuit breaker is open")
+        self.url = url
+
+
+class ApiResult(NamedTuple):
+    api: 'API'
+    data: Optional[dict]
+    result: Any
+    error: Optional[BaseException]
+
+
 class API(metaclass=ApiMetaClass):
     def __init__(self, url: str,
                  cooldown: float = 0., timeout: int = 10,
-                 disable: bool = False, proxy: str = get_sys_proxy()):
+                 disable: bool = False, proxy: str = get_sys_proxy(),
+                 cache_ttl: float = 0., cache_size: int = 128, cache_bytes: int = 1 << 20,
+                 stale_while_revalidate: bool = False,
+                 burst: int = 1, limit_by_host: bool = False, coalesce: bool = True,
+                 failure_threshold: int = 5, recovery_timeout: float = 30.,
+                 retries: int = 0, retry_backoff: float = 0.2, retry_max_backoff: float = 5.,
+                 hedge: bool = False, hedge_delay: Optional[float] = None):
 
         self.url = url
         self.cooldown = cooldown
         self.timeout = timeout
+        self.breaker = CircuitBreaker(failure_threshold, recovery_timeout)
         self.disable = disable
         self.proxy = proxy
 
+        # Responses are cached only when `cache_ttl` is set
+        self.cache = ResponseCache(cache_ttl, cache_size, cache_bytes) if cache_ttl > 0 else None
+        self.stale_while_revalidate = stale_while_revalidate
+        self._refreshing: Dict[Hashable, asyncio.Future] = {}
+
+        # `cooldown` is the average interval between requests, `burst` requests may be sent at once
+        if cooldown > 0:
+            self.bucket = (apimgr.get_host_bucket(urlsplit(url).netloc, cooldown, burst) if limit_by_host
+                           else TokenBucket(1 / cooldown, burst))
+        else:
+            self.bucket = None
+
+        # Identical concurrent GETs share one in-flight request
+        self.coalesce = coalesce
+        self._inflight: Dict[Hashable, list] = {}  # key -> [future, waiters]
+
+        # Idempotent calls are retried with exponential backoff and full jitter
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.retry_max_backoff = retry_max_backoff
+
+        # Idempotent calls send a second request if the first one is slower than `hedge_delay`,
+        # defaults to the observed p95 latency
+        self.hedge = hedge
+        self.hedge_delay = hedge_delay
+        self.latencies = deque(maxlen=256)
+
         apimgr.apis.add(self)
 
-    async def post(self, cmd: Command, data: dict) -> Optional[dict]:
+    @property
+    def disable(self) -> bool:
+        return self._disable or self.breaker.state == CircuitBreaker.OPEN
+
+    @disable.setter
+    def disable(self, value: bool) -> None:
+        self._disable = value
+
+    def get_latency_percentile(self, percentile: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100))]
+
+    def _cache_key(self, method: str, data: Optional[dict]) -> Hashable:
+        return method, self.url, json.dumps(data, sort_keys=True, default=str)
+
+    @asynccontextmanager
+    async def _open(self, method: str, data: Optional[dict] = None) -> AsyncIterator['aiohttp.ClientResponse']:
+        import aiohttp
+
+        if self._disable or (self.breaker.state == CircuitBreaker.OPEN and not _probing.get()):
+            raise ApiUnavailableError(self.url)
+        if self.bucket is not None:
+            await self.bucket.acquire()
+
+        session = apimgr.get_session(self.url, self.proxy)
+        trace_id = tracer.get_id()
         try:
-            async with aiohttp.ClientSession() as client:
-                async with client.post(self.url, data=data, timeout=self.timeout, proxy=self.proxy) as response:
+            async with session.request(method, self.url, data=data, timeout=self.timeout, proxy=self.proxy,
+                                       headers=None if trace_id is None else {'X-Request-ID': trace_id}) as response:
+                if response.status != 200:
+                    raise ApiStatusError(self.url, response.status)
+                self.breaker.record_success()
+                yield response
+        except ApiStatusError as e:
+            # A 4xx is caused by the request, the server itself is up
+            if e.transient:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.breaker.record_failure()
+            raise
 
-                    if response.status != 200:
-                        logger.warning(f"Call API failed: {self.url}, resp.status={response.status}")
-                        await cmd.send_failure("无法连接到服务器")
-                        return None
+    async def _fetch(self, method: str, data: Optional[dict] = None) -> Tuple[Any, int]:
+        """Perform the request and return the decoded response along with its size in bytes."""
+        import aiohttp
 
-                    resp = json.loads(await response.text())
-                    logger.debug(f"Called API: {self.url}, data={data}, resp={resp} ...")
-                    return resp
+        start = time.monotonic()
+        try:
+            async with self._open(method, data) as response:
+                body = await response.read()
+                elapsed = time.monotonic() - start
+                self.latencies.append(elapsed)
+                metrics.record('api:' + self.url, elapsed)
+                resp = fastjson.loads(body)
+                logger.debug(f"Called API: {self.url}, data={data}, resp={resp} ...")
+                return resp, len(body)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ApiStatusError):
+            metrics.record('api:' + self.url, time.monotonic() - start, error=True)
+            raise
 
-        except asyncio.TimeoutError:
-            logger.warning(f"Call API timeout: {self.url}")
-            await cmd.send_failure("请求超时")
+    async def _fetch_hedged(self, method: str, data: Optional[dict] = None) -> Tuple[Any, int]:
+        delay = self.hedge_delay if self.hedge_delay is not None else self.get_latency_percentile(95)
+        if delay is None:
+            return await self._fetch(method, data)
 
+        tasks = {asyncio.ensure_future(self._fetch(method, data))}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                logger.debug(f"Hedging API call after {delay:.3f}s: {self.url}")
+                tasks.add(asyncio.ensure_future(self._fetch(method, data)))
+
+            while True:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                succeeded = [task for task in done if task.exception() is None]
+                if succeeded or not tasks:
+                    return (succeeded or list(done))[0].result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _fetch_with_retry(self, method: str, data: Optional[dict], idempotent: bool) -> Tuple[Any, int]:
+        import aiohttp
+
+        attempts = self.retries + 1 if idempotent else 1
+        for attempt in range(attempts):
+            try:
+                if idempotent and self.hedge:
+                    return await self._fetch_hedged(method, data)
+                return await self._fetch(method, data)
+
+            except (aiohttp.ClientError, asyncio.TimeoutError, ApiStatusError) as e:
+                if attempt == attempts - 1 or (isinstance(e, ApiStatusError) and not e.transient):
+                    raise
+                delay = random.uniform(0, min(self.retry_max_backoff, self.retry_backoff * 2 ** attempt))
+                logger.debug(f"Retrying API call in {delay:.3f}s: {self.url}, {e!r}")
+                await asyncio.sleep(delay)
+
+    async def stream(self, method: str = 'GET', data: Optional[dict] = None,
+                     mode: str = 'chunks', chunk_size: int = 1 << 16, prefix: str = 'item') -> AsyncIterator[Any]:
+        """Iterate over the response without loading it into memory at once.
+
+        mode:
+            `chunks`: raw `bytes` chunks of at most `chunk_size`
+            `ndjson`: one decoded object per non-empty line
+            `items`:  objects under `prefix` of a single JSON document, requires `ijson`
+        """
+        if mode not in ('chunks', 'ndjson', 'items'):
+            raise ValueError(f"Unknown stream mode: {mode}")
+        if mode == 'items':
+            import ijson
+
+        async with self._open(method, data) as response:
+            if mode == 'chunks':
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    yield chunk
+
+            elif mode == 'ndjson':
+                buffer = b''
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    *lines, buffer = (buffer + chunk).split(b'\n')
+                    for line in lines:
+                        if line.strip():
+                            yield fastjson.loads(line)
+                if buffer.strip():
+                    yield fastjson.loads(buffer)
+
+            else:
+                async for item in ijson.items_async(response.content, prefix):
+                    yield item
+
+    async def download(self, method: str = 'GET', data: Optional[dict] = None,
+                       spill_threshold: int = 1 << 20, chunk_size: int = 1 << 16) -> SpooledTemporaryFile:
+        """Read the response into a file object which is kept in memory until it exceeds `spill_threshold` bytes,
+        and spilled to a temp file afterwards. The returned file is rewound, the caller should close it."""
+        file = SpooledTemporaryFile(max_size=spill_threshold)
+        try:
+            async with self._open(method, data) as response:
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    file.write(chunk)
+        except BaseException:
+            file.close()
+            raise
+        file.seek(0)
+        return file
+
+    async def _fetch_and_cache(self, method: str, data: Optional[dict] = None, idempotent: bool = False) -> Any:
+        resp, size = await self._fetch_with_retry(method, data, method == 'GET' or idempotent)
+        if self.cache is not None:
+            # The cache keeps its own copy, callers are free to change the response they get
+            self.cache.set(self._cache_key(method, data), copy.deepcopy(resp), size)
+        return resp
+
+    async def _refresh(self, key: Hashable, method: str, data: Optional[dict], idempotent: bool) -> None:
+        import aiohttp
 
-    async def get(self, cmd: Command) -> Optional[dict]:
         try:
+            await self._fetch_and_cache(method, data, idempotent)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ApiStatusError, ApiUnavailableError, ValueError) as e:
+            tracer.record('api-refresh:' + self.url, e)
+        finally:
+            self._refreshing.pop(key, None)
 
-            async with aiohttp.ClientSession() as client:
-                async with client.get(self.url, timeout=self.timeout, proxy=self.proxy) as response:
-                    if response.status != 200:
-                        logger.error(f"Call API failed: {self.url}, resp.status={response.status}")
-                        await cmd.send_failure("无法连接到服务器")
-                        return None
+    async def _fetch_coalesced(self, method: str, data: Optional[dict] = None) -> Any:
+        key = self._cache_key(method, data)
+        entry = self._inflight.get(key)
+        if entry is None:
+            entry = self._inflight[key] = [asyncio.ensure_future(self._fetch_and_cache(method, data)), 0]
+            entry[0].add_done_callback(lambda _: self._inflight.pop(key, None))
+
+        future = entry[0]
+        entry[1] += 1
+        try:
+            # Shielded, so a cancelled caller does not cancel the request shared with others.
+            # Every caller gets its own copy of the shared response
+            return copy.deepcopy(await asyncio.shield(future))
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not future.done():
+                future.cancel()
 
-                    resp = json.loads(await response.text())
-                    logger.debug(f"Called API: {self.url}, resp={resp} ...")
-                    return resp
+    async def request(self, method: str = 'GET', data: Optional[dict] = None, idempotent: bool = False) -> Any:
+        """Call the API through cache and rate limiter, raising on failure instead of notifying the user.
 
-        except asyncio.TimeoutError:
-            logger.warning(f"Call API timeout: {self.url}")
+        GET calls are always considered idempotent, set `idempotent` to allow retries and hedging of other calls.
+        The response returned is a copy, never the one kept in cache.
+        """
+        # A health check must reach the server, not a response cached before it went down
+        if self.cache is not None and not _probing.get():
+            key = self._cache_key(method, data)
+            fresh, resp = self.cache.get(key, allow_stale=self.stale_while_revalidate)
+            if fresh:
+                return copy.deepcopy(resp)
+            if resp is not None:
+                # Stale hit, serve it now and revalidate in background
+                if key not in self._refreshing:
+                    self._refreshing[key] = asyncio.ensure_future(self._refresh(key, method, data, idempotent))
+                return copy.deepcopy(resp)
+
+        if method == 'GET' and self.coalesce:
+            return await self._fetch_coalesced(method, data)
+        return await self._fetch_and_cache(method, data, idempotent)
+
+    async def _call(self, cmd: Command, method: str, data: Optional[dict] = None,
+                    idempotent: bool = False) -> Optional[Any]:
+        try:
+            return await self.request(method, data, idempotent)
+
+        except ApiUnavailableError:
+            logger.warning(f"Call API skipped, API unavailable: {self.url}")
+            await cmd.send_failure("服务暂不可用")
+
+        except ApiStatusError as e:
+            tracer.record('api:' + self.url, e)
+            await cmd.send_failure("无法连接到服务器")
+
+        except asyncio.TimeoutError as e:
+            tracer.record('api:' + self.url, e)
             await cmd.send_failure("请求超时")
 
+    async def post(self, cmd: Command, data: dict, idempotent: bool = False) -> Optional[dict]:
+        return await self._call(cmd, 'POST', data, idempotent)
+
+    async def get(self, cmd: Command) -> Optional[dict]:
+        return await self._call(cmd, 'GET')
+
     @abstractmethod
     async def test(self) -> bool:
+        """Check whether the API works, called by health checks.
+        Requests made here get through an open breaker and skip the cache."""
         raise NotImplementedError
@@ -0,0 +1,71 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+class ResponseCache:
+    """LRU cache with a per-entry TTL, bounded both in entries and in bytes."""
+
+    def __init__(self, ttl: float, max_entries: int = 128, max_bytes: int = 1 << 20):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        # key -> (expire_at, size, value), least recently used first
+        self._entries: 'OrderedDict[Hashable, Tuple[float, int, Any]]' = OrderedDict()
+        self._bytes = 0
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, allow_stale: bool = False) -> Tuple[bool, Optional[Any]]:
+        """Return `(fresh, value)`. `value` is None on a miss, and `fresh` is False for expired entries
+        which are only returned when `allow_stale` is set."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return False, None
+
+        expire_at, _, value = entry
+        if expire_at > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, value
+        if allow_stale:
+            self._entries.move_to_end(key)
+            self.stale_hits += 1
+            return False, value
+
+        self.pop(key)
+        self.misses += 1
+        return False, None
+
+    def set(self, key: Hashable, value: Any, size: int) -> None:
+        self.pop(key)
+        if size > self.max_bytes:
+            return
+
+        self._entries[key] = (time.monotonic() + self.ttl, size, value)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+
+    def pop(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+        }
@@ -1,18 +1,144 @@
-from datetime import datetime
+import asyncio
+import math
+import sys
+import time
+from contextlib import AsyncExitStack, suppress
 from functools import wraps
-from typing import Optional, Set, Union, Tuple, Dict, List, Any, Callable, NoReturn
-
-from nonebot import on_command
-from nonebot.adapters import Message, MessageSegment
+from itertools import product
+from typing import Optional, Set, Union, Tuple, Dict, List, Any, Callable, NoReturn, Type, FrozenSet, Iterable
+
+import nonebot
+from loguru import logger
+from nonebot import on_command, get_driver
+from nonebot.adapters import Bot, Event, Message, MessageSegment
+from nonebot.dependencies import Dependent
+from nonebot.exception import IgnoredException
 from nonebot.internal.adapter import MessageTemplate
 from nonebot.matcher import Matcher
+from nonebot.message import run_preprocessor, run_postprocessor
 from nonebot.permission import Permission
-from nonebot.typing import T_PermissionChecker, T_Handler
-
-from nonutils.stringres import Rstr
-
+from nonebot.rule import Rule
+from nonebot.typing import T_PermissionChecker, T_Handler, T_State, T_DependencyCache
+
+from nonutils.access import accessctl
+from nonutils.dispatch import CommandDispatcher
+from nonutils.fuzzy import NGramIndex
+from nonutils.metrics import metrics
+from nonutils.outbound import outbound, get_chat_id
+from nonutils.ratelimit import CooldownTracker
+from nonutils.session import sessions
+from nonutils.stringres import Strings, strings
+from nonutils.tracing import tracer
+
+try:
+    # Deferred registration builds matchers the way nonebot 2.0 does, with some of its internals
+    from nonebot.plugin import _current_plugin_chain
+    from nonebot.rule import CommandRule, TrieRule, TRIE_VALUE
+
+    _CAN_DEFER = (getattr(nonebot, '__version__', None) or '').startswith('2.0.')
+except ImportError:
+    _CAN_DEFER = False
+
+
+def _freeze_aliases(aliases: Optional[Set[Union[str, Tuple[str, ...]]]]) \
+        -> Optional[FrozenSet[Union[str, Tuple[str, ...]]]]:
+    """Aliases as a frozenset of interned names, None if there are none."""
+    if not aliases:
+        return None
+    return frozenset(sys.intern(a) if isinstance(a, str) else tuple(sys.intern(w) for w in a) for a in aliases)
+
+
+class _FlagsMixin:
+    """`enable` and `hidden` flags, the help index of `cmdmgr` is invalidated when they change."""
+    __slots__ = ()
+
+    @property
+    def enable(self) -> bool:
+        return self._enable
+
+    @enable.setter
+    def enable(self, value: bool) -> None:
+        self._enable = value
+        cmdmgr.invalidate_help()
+
+    @property
+    def hidden(self) -> bool:
+        return self._hidden
+
+    @hidden.setter
+    def hidden(self, value: bool) -> None:
+        self._hidden = value
+        cmdmgr.invalidate_help()
+
+
+class _LimitsMixin:
+    """Concurrency cap and per-user/per-group cooldown, checked before the handlers run.
+    The concurrency slot is only taken by the run of the matcher itself, so it is released
+    even if another preprocessor ignores the event.
+
+    max_concurrency: max number of running handlers, None for unlimited
+    queue_when_busy: wait for a free slot instead of rejecting when the cap is hit
+    cooldown: seconds before the same user or group can trigger again
+    cooldown_scope: `user` or `group`
+    session_ttl: seconds a multi-turn session waits for the user to reply, see `SessionStore`
+    """
+    __slots__ = ()
+
+    def _init_limits(self, max_concurrency: Optional[int] = None, queue_when_busy: bool = False,
+                     cooldown: float = 0., cooldown_scope: str = 'user',
+                     session_ttl: Optional[float] = None) -> None:
+        if cooldown_scope not in ('user', 'group'):
+            raise ValueError(f"Invalid cooldown scope: {cooldown_scope}")
+
+        self.max_concurrency = max_concurrency
+        self.queue_when_busy = queue_when_busy
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        # Only created for commands with a concurrency cap
+        self._running: Optional[Set[int]] = None
+
+        self.cooldown_scope = cooldown_scope
+        self._cooldowns = CooldownTracker(cooldown) if cooldown > 0 else None
+        self.session_ttl = session_ttl
+
+    async def _check_limits(self, bot: Bot, event: Event) -> bool:
+        """Tell the user and return False if the command is busy or cooling down."""
+        if self.max_concurrency and not self.queue_when_busy \
+                and self._semaphore is not None and self._semaphore.locked():
+            res = strings.for_event(event)
+            await bot.send(event, res.FORMAT_WARNING_MSG.format(cmd=self.get_name_str(), msg=res.MSG_CMD_BUSY))
+            return False
+
+        # Only hit once the call is sure not to be rejected as busy
+        if self._cooldowns is not None:
+            key = event.get_user_id() if self.cooldown_scope == 'user' else get_chat_id(event)
+            remaining = self._cooldowns.hit(key)
+            if remaining > 0:
+                res = strings.for_event(event)
+                await bot.send(event, res.FORMAT_WARNING_MSG.format(
+                    cmd=self.get_name_str(), msg=res.MSG_CMD_COOLDOWN.format(remaining=math.ceil(remaining))))
+                return False
+        return True
+
+    async def _acquire(self, matcher: Matcher) -> None:
+        if self.max_concurrency:
+            if self._semaphore is None:
+                self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            await self._semaphore.acquire()
+            if self._running is None:
+                self._running = set()
+            self._running.add(id(matcher))
+
+    def _release(self, matcher: Matcher) -> None:
+        if self._running is not None and id(matcher) in self._running:
+            self._running.remove(id(matcher))
+            self._semaphore.release()
+
+
+class Command(_FlagsMixin, _LimitsMixin):
+    __slots__ = ('cmd', 'aliases', 'permission', '_enable', '_hidden', 'desc', 'usage',
+                 'max_concurrency', 'queue_when_busy', '_semaphore', '_running', 'cooldown_scope', '_cooldowns',
+                 'session_ttl', 'access_bits', 'matcher')
 
-class Command:
     def __init__(self,
                  cmd: str,
                  aliases: Optional[Set[Union[str, Tuple[str, ...]]]] = None,
@@ -21,16 +147,23 @@ class Command:
                  hidden: bool = False,
                  desc: Optional[str] = None,
                  usage: Optional[str] = None,
+                 max_concurrency: Optional[int] = None,
+                 queue_when_busy: bool = False,
+                 cooldown: float = 0.,
+                 cooldown_scope: str = 'user',
+                 session_ttl: Optional[float] = None,
                  **kwargs):
-        self.cmd = cmd
-        self.aliases = aliases
+        self.cmd = cmd = sys.intern(cmd)
+        self.aliases = aliases = _freeze_aliases(aliases)
         self.permission = permission
         self.enable = enable
         self.hidden = hidden
         self.desc = desc
         self.usage = usage
+        self._init_limits(max_concurrency, queue_when_busy, cooldown, cooldown_scope, session_ttl)
+        self.access_bits = accessctl.get_bit(cmd)
 
-        self.matcher = on_command(cmd=cmd, aliases=aliases, permission=permission, **kwargs)
+        self.matcher = cmdmgr.new_matcher(self, cmd=cmd, aliases=aliases, permission=permission, **kwargs)
         cmdmgr.register_cmd(self)
 
 
@@ -99,6 +232,8 @@ class Command:
             message: 消息内容
             kwargs: {ref}`nonebot.adapters.Bot.send` 的参数，请参考对应 adapter 的 bot 对象 api
         """
+        if outbound.enabled:
+            return await outbound.put(message, **kwargs)
         return await self.matcher.send(message=message, **kwargs)
 
     @wraps(Matcher.finish)
@@ -113,6 +248,10 @@ class Command:
             message: 消息内容
             kwargs: {ref}`nonebot.adapters.Bot.send` 的参数，请参考对应 adapter 的 bot 对象 api
         """
+        if outbound.enabled and message is not None:
+            # Keep the order with messages still in the outbound queue
+            await outbound.put(message, **kwargs)
+            message = None
         return await self.matcher.finish(message=message, **kwargs)
 
     @wraps(Matcher.pause)
@@ -127,6 +266,9 @@ class Command:
             prompt: 消息内容
             kwargs: {ref}`nonebot.adapters.Bot.send` 的参数，请参考对应 adapter 的 bot 对象 api
         """
+        if outbound.enabled and prompt is not None:
+            await outbound.put(prompt, **kwargs)
+            prompt = None
         return await self.matcher.pause(prompt=prompt, **kwargs)
 
     @wraps(Matcher.reject)
@@ -142,6 +284,9 @@ class Command:
             prompt: 消息内容
             kwargs: {ref}`nonebot.adapters.Bot.send` 的参数，请参考对应 adapter 的 bot 对象 api
         """
+        if outbound.enabled and prompt is not None:
+            await outbound.put(prompt, **kwargs)
+            prompt = None
         return await self.matcher.reject(prompt, **kwargs)
 
     # ==================================================
@@ -151,44 +296,35 @@ class Command:
     async def send(self, message: Union[str, Message, MessageSegment],
                    **kwargs):
         return await self.send_raw(
-            Rstr.FORMAT_BASIC_MSG.format(cmd=self.get_name_str(), msg=message,
-                                         time=datetime.now().strftime('%H:%M')),
-            **kwargs)
+            strings.for_event().FORMAT_BASIC_MSG.format(cmd=self.get_name_str(), msg=message), **kwargs)
 
     async def send_failure(self, message: Union[str, Message, MessageSegment],
                            **kwargs):
-        return await self.send(
-            Rstr.FORMAT_FAILURE_MSG.format(cmd=self.get_name_str(), msg=message,
-                                           time=datetime.now().strftime('%H:%M')),
-            **kwargs)
+        return await self.send_raw(
+            strings.for_event().FORMAT_FAILURE_MSG.format(cmd=self.get_name_str(), msg=message), **kwargs)
 
     async def send_warning(self, message: Union[str, Message, MessageSegment],
                            **kwargs):
-        return await self.send(
-            Rstr.FORMAT_WARNING_MSG.format(cmd=self.get_name_str(), msg=message,
-                                           time=datetime.now().strftime('%H:%M')),
-            **kwargs)
+        return await self.send_raw(
+            strings.for_event().FORMAT_WARNING_MSG.format(cmd=self.get_name_str(), msg=message), **kwargs)
 
     async def send_question(self, message: Union[str, Message, MessageSegment],
                             **kwargs):
-        return await self.send(
-            Rstr.FORMAT_QUESTION_MSG.format(cmd=self.get_name_str(), msg=message,
-                                            time=datetime.now().strftime('%H:%M')),
-            **kwargs)
+        return await self.send_raw(
+            strings.for_event().FORMAT_QUESTION_MSG.format(cmd=self.get_name_str(), msg=message), **kwargs)
 
     async def send_success(self, message: Union[str, Message, MessageSegment],
                            **kwargs):
-        return await self.send(
-            Rstr.FORMAT_SUCCESS_MSG.format(cmd=self.get_name_str(), msg=message,
-                                           time=datetime.now().strftime('%H:%M')),
-            **kwargs)
+        return await self.send_raw(
+            strings.for_event().FORMAT_SUCCESS_MSG.format(cmd=self.get_name_str(), msg=message), **kwargs)
 
     def get_name_str(self) -> str:
         return self.cmd
 
-    def get_usage_str(self) -> str:
-        return Rstr.MSG_CMD_USAGE.format(cmd=self.cmd,
-                                         doc=(self.usage if self.usage else Rstr.EXPR_NOT_AVAILABLE))
+    def get_usage_str(self, res: Optional[Strings] = None) -> str:
+        res = res or strings.get()
+        return res.MSG_CMD_USAGE.format(cmd=self.cmd,
+                                        usage=(self.usage if self.usage else res.EXPR_NOT_AVAILABLE))
 
     def __repr__(self):
         return f"<Command '{self.get_name_str()}'>"
@@ -197,7 +333,10 @@ class Command:
         return self.__repr__()
 
 
-class Switch:
+class Switch(_FlagsMixin, _LimitsMixin):
+    __slots__ = ('base_cmd', 'switch', '_name', '_enable', '_hidden', 'usage',
+                 'max_concurrency', 'queue_when_busy', '_semaphore', '_running', 'cooldown_scope', '_cooldowns',
+                 'session_ttl', 'parent', 'access_bits', 'matcher')
 
     def __init__(self,
                  base_cmd: str,
@@ -207,21 +346,39 @@ class Switch:
                  enable: bool = True,
                  hidden: bool = False,
                  usage: Optional[str] = None,
+                 max_concurrency: Optional[int] = None,
+                 queue_when_busy: bool = False,
+                 cooldown: float = 0.,
+                 cooldown_scope: str = 'user',
+                 session_ttl: Optional[float] = None,
                  **kwargs):
-        self.switch = switch
+        self.base_cmd = base_cmd
+        self.switch = switch = sys.intern(switch)
+        self._name = sys.intern(f"{base_cmd} {switch}")
         self.hidden = hidden
         self.enable = enable
         self.usage = usage
+        self._init_limits(max_concurrency, queue_when_busy, cooldown, cooldown_scope, session_ttl)
+        self.parent: Optional[CommandWithSwitch] = None
+        # Disabling the command also disables its switches
+        self.access_bits = accessctl.get_bit(self.get_name_str())
 
-        self.matcher = on_command(cmd=(base_cmd + ' ' + switch).strip(),
-                                  aliases={(als + ' ' + switch).strip() for als in base_aliases},
-                                  permission=permission,
-                                  **kwargs)
+        aliases = _freeze_aliases({(als + ' ' + switch).strip() for als in base_aliases}) if base_aliases else None
+        self.matcher = cmdmgr.new_matcher(self, cmd=self._name.strip(), aliases=aliases, permission=permission,
+                                          **kwargs)
 
         # TODO: Inherit funcs form `Command`.
 
+    def get_name_str(self) -> str:
+        return self._name
+
+    def __repr__(self):
+        return f"<Switch '{self.get_name_str()}'>"
+
+
+class CommandWithSwitch(_FlagsMixin):
+    __slots__ = ('cmd', 'aliases', 'permission', '_enable', '_hidden', 'desc', 'usage', 'switches', 'access_bits')
 
-class CommandWithSwitch:
     def __init__(self,
                  cmd: str,
                  aliases: Optional[Set[Union[str, Tuple[str, ...]]]] = None,
@@ -230,8 +387,8 @@ class CommandWithSwitch:
                  desc: Optional[str] = None,
                  usage: Optional[str] = None,
                  permission: Optional[Union[Permission, T_PermissionChecker]] = None):
-        self.cmd = cmd
-        self.aliases = aliases
+        self.cmd = sys.intern(cmd)
+        self.aliases = _freeze_aliases(aliases)
         self.permission = permission
         self.enable = enable
         self.hidden = hidden
@@ -239,6 +396,7 @@ class CommandWithSwitch:
         self.usage = usage
 
         self.switches: Dict[str, Switch] = {}
+        self.access_bits = accessctl.get_bit(cmd)
 
         cmdmgr.register_cmd(self)
 
@@ -257,23 +415,192 @@ class CommandWithSwitch:
                                        hidden=(self.hidden if hidden is None else hidden),
                                        permission=(self.permission if permission is None else permission),
                                        usage=usage, **kwargs)
+        self.switches[switch].parent = self
+        self.switches[switch].access_bits |= self.access_bits
+        cmdmgr.add_name(self.switches[switch].get_name_str(), self.switches[switch])
+        cmdmgr.invalidate_help()
         return self.switches[switch]
 
-    def get_switch(self, switch: str):
-        return self.switches[switch]
+    def get_switch(self, switch: str) -> Optional[Switch]:
+        return self.switches.get(switch)
+
+    def get_usage_str(self, res: Optional[Strings] = None) -> str:
+        res = res or strings.get()
+        sw_usage = [res.FORMAT_SWITCHES_LIST.format(
+                        usage=(s.usage if s.usage else self.cmd + ' ' + s.switch + res.EXPR_NOT_AVAILABLE))
+                    for s in self.switches.values() if not s.hidden and s.enable]
+        return res.MSG_CMD_WITH_SWITCH_USAGE.format(cmd=self.cmd,
+                                                    doc=(self.usage if self.usage else res.EXPR_NOT_AVAILABLE),
+                                                    switch_list=('\n'.join(sw_usage) if sw_usage
+                                                                 else res.EXPR_NOT_AVAILABLE))
+
+
+def _deep_sizeof(objs: Iterable[Any], seen: Set[int]) -> int:
+    """Size of `objs` and of the builtin containers and commands they reference, each object counted once.
+    Other objects only count for their own size, classes and callables are skipped."""
+    size = 0
+    stack = list(objs)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, type) or callable(obj):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif isinstance(obj, (Command, Switch, CommandWithSwitch)):
+            stack.extend(getattr(obj, slot) for slot in type(obj).__slots__ if hasattr(obj, slot))
+    return size
+
+
+class _PendingMatcher:
+    """Stand-in for the matcher of a command until `CmdManager.register_pending`,
+    recording the handlers added to it so they can be added to the real matcher."""
+
+    # Parameters of `CommandRule`, the same for every command, parsed once instead of for every matcher
+    _rule_params: Optional[Dependent[bool]] = None
+
+    def __init__(self, owner: Union[Command, Switch], cmd: str,
+                 aliases: Optional[Set[Union[str, Tuple[str, ...]]]], kwargs: Dict[str, Any]):
+        self.owner = owner
+        self.cmd = cmd
+        self.aliases = aliases
+        self.kwargs = kwargs
+        # The plugin being loaded is only known now
+        chain = _current_plugin_chain.get()
+        self.plugin = chain[-1] if chain else None
+        self._replays: List[Callable[[Type[Matcher]], Any]] = []
 
-    def get_usage_str(self):
-        sw_usage = [(s.usage if s.usage else self.cmd + ' ' + s.switch + Rstr.EXPR_NOT_AVAILABLE)
-                    for s in self.switches.values() if not s.hidden]
-        return Rstr.MSG_CMD_WITH_SWITCH_USAGE.format(cmd=self.cmd,
-                                                     usage=(self.usage if self.usage else Rstr.EXPR_NOT_AVAILABLE),
-                                                     switches_usage='\n'.join(sw_usage).strip())
-    # TODO: enable control, permission control
+    def _record(self, replay: Callable[[Type[Matcher], T_Handler], Any]) -> Callable[[T_Handler], T_Handler]:
+        def decorator(func: T_Handler) -> T_Handler:
+            self._replays.append(lambda matcher: replay(matcher, func))
+            return func
+
+        return decorator
+
+    def handle(self, parameterless: Optional[List[Any]] = None) -> Callable[[T_Handler], T_Handler]:
+        return self._record(lambda m, f: m.handle(parameterless=parameterless)(f))
+
+    def receive(self, id: str = "", parameterless: Optional[List[Any]] = None) -> Callable[[T_Handler], T_Handler]:
+        return self._record(lambda m, f: m.receive(id=id, parameterless=parameterless)(f))
+
+    def got(self, key: str,
+            prompt: Optional[Union[str, Message, MessageSegment, MessageTemplate]] = None,
+            parameterless: Optional[List[Any]] = None) -> Callable[[T_Handler], T_Handler]:
+        return self._record(lambda m, f: m.got(key=key, prompt=prompt, parameterless=parameterless)(f))
+
+    def append_handler(self, handler: T_Handler, parameterless: Optional[List[Any]] = None) -> None:
+        self._record(lambda m, f: m.append_handler(f, parameterless=parameterless))(handler)
+
+    def _command_rule(self, force_whitespace: Optional[Union[str, bool]]) -> Rule:
+        """Same as `nonebot.rule.command` of nonebot 2.0, reusing the parsed parameters of the rule."""
+        config = get_driver().config
+        commands: List[Tuple[str, ...]] = []
+        for cmd in {self.cmd} | (self.aliases or set()):
+            cmd = (cmd,) if isinstance(cmd, str) else cmd
+            commands.append(cmd)
+            if len(cmd) == 1:
+                for start in config.command_start:
+                    TrieRule.add_prefix(f"{start}{cmd[0]}", TRIE_VALUE(start, cmd))
+            else:
+                for start, sep in product(config.command_start, config.command_sep):
+                    TrieRule.add_prefix(f"{start}{sep.join(cmd)}", TRIE_VALUE(start, cmd))
+
+        checker = CommandRule(commands, force_whitespace)
+        if _PendingMatcher._rule_params is None:
+            _PendingMatcher._rule_params = Dependent[bool].parse(call=checker, allow_types=Rule.HANDLER_PARAM_TYPES)
+        params = _PendingMatcher._rule_params
+        return Rule(Dependent[bool](call=checker, params=params.params, parameterless=params.parameterless))
+
+    def register(self) -> Type[Matcher]:
+        """Create the matcher like `on_command` does, without inspecting the call stack for every matcher."""
+        kwargs = dict(self.kwargs)
+        kwargs.setdefault('block', False)
+        if 'state' in kwargs:
+            kwargs['default_state'] = kwargs.pop('state')
+        rule = self._command_rule(kwargs.pop('force_whitespace', None)) & kwargs.pop('rule', None)
+
+        matcher = Matcher.new('message', Rule() & rule, Permission() | kwargs.pop('permission', None),
+                              plugin=self.plugin, module=(self.plugin.module if self.plugin else None), **kwargs)
+        if self.plugin is not None:
+            self.plugin.matcher.add(matcher)
+        for replay in self._replays:
+            replay(matcher)
+        return matcher
 
 
 class CmdManager:
     def __init__(self):
         self.commands: Dict[str, Union[Command, CommandWithSwitch]] = {}
+        self.dispatcher: Optional[CommandDispatcher] = None
+        self.owners: Dict[Type[Matcher], Union[Command, Switch]] = {}
+        self._pending: Optional[List[_PendingMatcher]] = None
+
+        # Names, aliases and switch names -> their command or switch, for suggestions
+        self.names: Dict[str, Union[Command, CommandWithSwitch, Switch]] = {}
+        self.name_index = NGramIndex()
+
+        # Pre-rendered help per locale, rebuilt lazily after `help_version` is bumped
+        self.help_page_size = 20
+        self.help_version = 0
+        self._help_pages: Dict[str, List[str]] = {}
+        self._help_usages: Dict[str, Dict[str, str]] = {}
+
+    def use_dispatcher(self) -> None:
+        """Route all commands and switches created afterwards through one matcher per priority.
+
+        Should be called before any plugin using `nonutils` is loaded.
+        """
+        if self.dispatcher is None:
+            self.dispatcher = CommandDispatcher()
+
+    def defer_registration(self) -> None:
+        """Record the matchers of commands and switches created afterwards, and register them all
+        on startup instead of one by one while plugins are imported.
+
+        Until then `Command.matcher` only supports `handle`, `receive`, `got` and `append_handler`.
+        Should be called before any plugin using `nonutils` is loaded. Only supported with nonebot 2.0,
+        matchers are registered right away with other versions.
+        """
+        if not _CAN_DEFER:
+            logger.warning(f"Deferred registration is not supported with nonebot {nonebot.__version__}, "
+                           f"commands are registered when created")
+            return
+        if self._pending is None:
+            self._pending = []
+            get_driver().on_startup(self.register_pending)
+
+    async def register_pending(self) -> None:
+        """Register the matchers recorded since `defer_registration`, on startup in the event loop."""
+        self._register_pending()
+
+    def _register_pending(self) -> None:
+        pending, self._pending = self._pending or [], None
+        for p in pending:
+            p.owner.matcher = p.register()
+            self._attach(p.owner, p.owner.matcher, p.cmd, p.aliases)
+
+    def new_matcher(self, owner: Union[Command, Switch],
+                    cmd: str, aliases: Optional[Set[Union[str, Tuple[str, ...]]]] = None,
+                    **kwargs) -> Union[Type[Matcher], _PendingMatcher]:
+        if self._pending is not None:
+            pending = _PendingMatcher(owner, cmd, aliases, kwargs)
+            self._pending.append(pending)
+            return pending
+
+        matcher = on_command(cmd=cmd, aliases=aliases, **kwargs)
+        self._attach(owner, matcher, cmd, aliases)
+        return matcher
+
+    def _attach(self, owner: Union[Command, Switch], matcher: Type[Matcher],
+                cmd: str, aliases: Optional[Set[Union[str, Tuple[str, ...]]]]) -> None:
+        self.owners[matcher] = owner
+        matcher.run = _run_with_limits
+        if self.dispatcher is not None:
+            self.dispatcher.add(matcher, {cmd} | (aliases or set()))
 
     def register_cmd(self, cmd_obj: Union[Command, CommandWithSwitch]) -> None:
         if ' ' in cmd_obj.cmd:
@@ -281,6 +608,93 @@ class CmdManager:
         if self.fetch_cmd(cmd_obj.cmd):
             raise ValueError(f"Command duplicated: {cmd_obj.cmd}.")
         self.commands[cmd_obj.cmd] = cmd_obj
+        for name in {cmd_obj.cmd} | (cmd_obj.aliases or set()):
+            self.add_name(name if isinstance(name, str) else ' '.join(name), cmd_obj)
+        self.invalidate_help()
+
+    def bulk_register(self, specs: Iterable[Dict[str, Any]]) -> List[Command]:
+        """Create many commands at once, each from the keyword arguments of `Command`.
+
+        Names and aliases of all of them are checked for duplicates in one pass before any is created,
+        and their matchers are registered together like with `defer_registration` (with nonebot 2.0).
+        If any of them fails, none is registered.
+        """
+        specs = list(specs)
+        seen: Set[str] = set()
+        duplicated: List[str] = []
+        for spec in specs:
+            cmd = spec['cmd']
+            if ' ' in cmd:
+                raise ValueError(f'Space is invalid in command name: {cmd}')
+            for name in (cmd, *(spec.get('aliases') or ())):
+                name = name if isinstance(name, str) else ' '.join(name)
+                if name in seen or name in self.commands or name in self.names:
+                    duplicated.append(name)
+                seen.add(name)
+        if duplicated:
+            raise ValueError(f"Commands duplicated: {', '.join(duplicated)}.")
+
+        # Registered on startup with the others, right away without deferral, or together now
+        temporary = self._pending is None and _CAN_DEFER
+        if temporary:
+            self._pending = []
+        counts = len(self.commands), len(self.names), len(self.owners), len(self._pending or ())
+        try:
+            commands = [Command(**spec) for spec in specs]
+            if temporary:
+                self._register_pending()
+        except Exception:
+            self._rollback(*counts, temporary)
+            raise
+        return commands
+
+    def _rollback(self, n_commands: int, n_names: int, n_owners: int, n_pending: int, temporary: bool) -> None:
+        # Only added to since the counts were taken, and dicts keep their insertion order
+        for name in list(self.commands)[n_commands:]:
+            del self.commands[name]
+        for name in list(self.names)[n_names:]:
+            del self.names[name]
+            self.name_index.discard(name)
+        for matcher in list(self.owners)[n_owners:]:
+            del self.owners[matcher]
+            if self.dispatcher is not None:
+                self.dispatcher.remove(matcher)
+            else:
+                with suppress(ValueError):
+                    matcher.destroy()
+        if temporary:
+            self._pending = None
+        elif self._pending is not None:
+            del self._pending[n_pending:]
+        self.invalidate_help()
+
+    def add_name(self, name: str, obj: Union[Command, CommandWithSwitch, Switch]) -> None:
+        """Make `name` suggested for `obj`, see `suggest`."""
+        self.names.setdefault(name, obj)
+        self.name_index.add(name)
+
+    def suggest(self, word: str, k: int = 3, max_dist: Optional[int] = None) -> List[str]:
+        """Names of up to `k` visible commands and switches whose name or alias is closest to `word`.
+
+        max_dist: max edit distance, by default 1 for words up to 5 characters and 2 for longer ones
+        """
+        if max_dist is None:
+            max_dist = 1 if len(word) <= 5 else 2
+        suggestions: List[str] = []
+        # Close matches are much cheaper to find, only look further if there are not enough of them
+        for dist in range(min(1, max_dist), max_dist + 1):
+            suggestions = []
+            for _, name in self.name_index.search(word, dist):
+                obj = self.names[name]
+                if obj.hidden or (isinstance(obj, Switch) and obj.parent is not None and obj.parent.hidden):
+                    continue
+                # Aliases suggest the name of their command
+                name = obj.get_name_str() if isinstance(obj, Switch) else obj.cmd
+                if name not in suggestions:
+                    suggestions.append(name)
+                    if len(suggestions) == k:
+                        return suggestions
+        return suggestions
 
     def fetch_cmd(self, cmd: str) -> Optional[Union[Command, CommandWithSwitch]]:
         if cmd in self.commands.keys():
@@ -294,5 +708,133 @@ class CmdManager:
         else:
             return set(self.commands.values())
 
+    def memory_report(self) -> Dict[str, Any]:
+        """Approximate bytes held by the registered commands, their matchers and the name index,
+        objects shared between them are counted once."""
+        seen: Set[int] = set()
+        cmds = list(self.commands.values())
+        switches = [s for c in cmds if isinstance(c, CommandWithSwitch) for s in c.switches.values()]
+
+        objects = _deep_sizeof([*cmds, *switches], seen)
+        matchers = 0
+        for m in self.owners:
+            matchers += sys.getsizeof(m) + sys.getsizeof(dict(vars(m)))
+            matchers += _deep_sizeof([m.handlers, m.rule.checkers, m.permission.checkers], seen)
+        index = _deep_sizeof([self.commands, self.names, self.owners, self.name_index._words,
+                              self.name_index._masks, self.name_index._ids, self.name_index._postings,
+                              self.name_index._by_length], seen)
+        if self.dispatcher is not None:
+            index += _deep_sizeof([self.dispatcher.routes], seen)
+
+        total = objects + matchers + index
+        return {
+            'commands': len(cmds),
+            'switches': len(switches),
+            'objects': objects,
+            'matchers': matchers,
+            'index': index,
+            'total': total,
+            # Switches have matchers of their own, so they count as commands here
+            'per_command': total / (len(cmds) + len(switches)) if cmds else 0.,
+        }
+
+    def invalidate_help(self) -> None:
+        self.help_version += 1
+        self._help_pages.clear()
+        self._help_usages.clear()
+
+    def _build_help(self, res: Strings) -> None:
+        # Disabled commands cannot be used, so they are left out like hidden ones
+        cmds = sorted((c for c in self.get_all_cmds(exclude_hidden_cmd=True) if c.enable), key=lambda c: c.cmd)
+        cmd_list = [res.FORMAT_CMDS_LIST.format(cmd=c.cmd, desc=(c.desc if c.desc else '')) for c in cmds]
+
+        pages = [cmd_list[i:i + self.help_page_size] for i in range(0, len(cmd_list), self.help_page_size)]
+        self._help_pages[res.locale] = [
+            res.MSG_MAIN_USAGE_DOC.format(cmd_list='\n'.join(page))
+            + (res.FORMAT_HELP_PAGE.format(page=i + 1, total=len(pages)) if len(pages) > 1 else '')
+            for i, page in enumerate(pages)
+        ] or [res.MSG_MAIN_USAGE_DOC.format(cmd_list=res.EXPR_NO_CMDS)]
+        usages = self._help_usages[res.locale] = {name: c.get_usage_str(res) for name, c in self.commands.items()}
+        # Switches share the help of their command
+        for name, c in self.commands.items():
+            if isinstance(c, CommandWithSwitch):
+                usages.update({s.get_name_str(): usages[name] for s in c.switches.values()})
+
+    def get_help_page(self, page: int = 1, locale: Optional[str] = None) -> str:
+        res = strings.get(locale)
+        if res.locale not in self._help_pages:
+            self._build_help(res)
+        pages = self._help_pages[res.locale]
+        return pages[min(max(page, 1), len(pages)) - 1]
+
+    def get_cmd_usage(self, cmd: str, locale: Optional[str] = None) -> Optional[str]:
+        res = strings.get(locale)
+        if res.locale not in self._help_pages:
+            self._build_help(res)
+        return self._help_usages[res.locale].get(cmd)
 
 cmdmgr = CmdManager()
+
+
+@run_preprocessor
+async def _before_run(matcher: Matcher, bot: Bot, event: Event):
+    tracer.begin(matcher)
+    owner = cmdmgr.owners.get(type(matcher))
+    if owner is None:
+        # The reply to a multi-turn session, checks were done when the command started
+        sessions.resume(type(matcher))
+        return
+
+    if not owner.enable or (isinstance(owner, Switch) and owner.parent is not None and not owner.parent.enable):
+        raise IgnoredException(f"{owner} is disabled")
+    if not accessctl.is_allowed(owner.access_bits, event):
+        raise IgnoredException(f"{owner} is disabled in this chat")
+    if not await owner._check_limits(bot, event):
+        raise IgnoredException(f"{owner} is cooling down or busy")
+
+
+async def _run_with_limits(self: Matcher, bot: Bot, event: Event, state: T_State,
+                           stack: Optional[AsyncExitStack] = None,
+                           dependency_cache: Optional[T_DependencyCache] = None) -> None:
+    """`Matcher.run` of the matchers of commands, holding a concurrency slot and measuring the run.
+
+    nonebot skips postprocessors when a preprocessor ignores the event, so what must be undone
+    after the run is done here instead."""
+    owner = cmdmgr.owners.get(type(self))
+    if owner is None:
+        # Temporary matchers of multi-turn sessions inherit this method
+        await Matcher.run(self, bot, event, state, stack, dependency_cache)
+        owner = sessions.get_owner(type(self))
+        if owner is not None:
+            sessions.track(self, owner, bot, event)
+        return
+
+    await owner._acquire(self)
+    name = 'cmd:' + owner.get_name_str()
+    metrics.begin_profile(id(self))
+    started = time.perf_counter()
+    error = False
+    try:
+        await Matcher.run(self, bot, event, state, stack, dependency_cache)
+        # Before anything else can run, while the temporary matcher of a pause is the last one
+        sessions.track(self, owner, bot, event)
+    except Exception:
+        error = True
+        raise
+    finally:
+        owner._release(self)
+        elapsed = time.perf_counter() - started
+        metrics.record(name, elapsed, error)
+        metrics.end_profile(id(self), name, elapsed)
+
+
+@run_postprocessor
+async def _after_run(matcher: Matcher, bot: Bot, event: Event, exception: Optional[Exception]):
+    if exception is None:
+        return
+    owner = cmdmgr.owners.get(type(matcher))
+    if owner is None:
+        owner = sessions.get_owner(type(matcher))
+    # Already logged by nonebot
+    tracer.record('cmd:' + owner.get_name_str() if owner is not None else str(type(matcher)), exception,
+                  log=False)
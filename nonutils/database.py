@@ -0,0 +1,284 @@
+import asyncio
+import queue
+import re
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, TypeVar
+
+from loguru import logger
+from nonebot import get_driver
+
+db_dir: Path = Path("data")
+
+_IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+T = TypeVar('T')
+
+
+def check_identifier(name: str) -> str:
+    if not _IDENTIFIER.match(name):
+        raise ValueError(f"Invalid SQL identifier: {name}")
+    return name
+
+
+def is_transient(e: sqlite3.Error) -> bool:
+    """Whether the same statement may succeed later, e.g. `database is locked`."""
+    return isinstance(e, sqlite3.OperationalError) and ('locked' in str(e) or 'busy' in str(e))
+
+
+class QueryStats:
+    __slots__ = ('count', 'total', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def record(self, elapsed: float) -> None:
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+    def to_dict(self) -> Dict[str, float]:
+        return {'count': self.count, 'total': self.total, 'max': self.max,
+                'avg': self.total / self.count if self.count else 0.}
+
+
+class Database:
+    """SQLite database queried from worker threads, so the event loop never blocks.
+
+    Each worker borrows a connection from a pool of `pool_size` connections. Compiled statements are
+    cached per connection (`cached_statements`). Rows added by `insert_later` are written in batches
+    every `batch_size` rows or `batch_delay` seconds, one transaction per table and columns, so a failing
+    table never loses the rows of the others. Rows failing on a lock are queued again for the next batch.
+    """
+
+    def __init__(self, path: Optional[Path] = None, pool_size: int = 4, cached_statements: int = 256,
+                 batch_size: int = 500, batch_delay: float = 0.5):
+        self.path = path
+        self.pool_size = pool_size
+        self.cached_statements = cached_statements
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+
+        self._pool: 'queue.Queue[sqlite3.Connection]' = queue.Queue()
+        self._conns: List[sqlite3.Connection] = []
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+        self.stats: Dict[str, QueryStats] = defaultdict(QueryStats)
+        self._stats_lock = threading.Lock()
+
+        # (table, columns) -> rows waiting to be inserted
+        self._pending_rows: Dict[Tuple[str, Tuple[str, ...]], List[tuple]] = defaultdict(list)
+        self._pending_count = 0
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flush_tasks: set = set()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.path is None:
+            db_dir.mkdir(parents=True, exist_ok=True)
+            self.path = db_dir / 'nonutils.db'
+        conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None,
+                               cached_statements=self.cached_statements)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def _with_conn(self, func: Callable[[sqlite3.Connection], T]) -> T:
+        # Runs in a worker thread, there are never more workers than connections
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+            self._conns.append(conn)
+        try:
+            return func(conn)
+        finally:
+            self._pool.put(conn)
+
+    async def run(self, func: Callable[[sqlite3.Connection], T]) -> T:
+        """Run `func` with a pooled connection in a worker thread."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix='nonutils-db')
+        return await asyncio.get_event_loop().run_in_executor(self._executor, self._with_conn, func)
+
+    def _timed(self, sql: str, func: Callable[[], T]) -> T:
+        start = time.perf_counter()
+        try:
+            return func()
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._stats_lock:
+                self.stats[sql].record(elapsed)
+
+    async def execute(self, sql: str, params: Sequence[Any] = ()) -> int:
+        """Execute a statement and return the number of affected rows."""
+        return await self.run(lambda conn: self._timed(sql, lambda: conn.execute(sql, params).rowcount))
+
+    async def executemany(self, sql: str, seq_of_params: Iterable[Sequence[Any]]) -> int:
+        """Execute a statement for every parameter set in a single transaction."""
+        def func(conn: sqlite3.Connection) -> int:
+            with conn:
+                conn.execute('BEGIN')
+                return conn.executemany(sql, seq_of_params).rowcount
+        return await self.run(lambda conn: self._timed(sql, lambda: func(conn)))
+
+    async def fetchall(self, sql: str, params: Sequence[Any] = ()) -> List[sqlite3.Row]:
+        return await self.run(lambda conn: self._timed(sql, lambda: conn.execute(sql, params).fetchall()))
+
+    async def fetchone(self, sql: str, params: Sequence[Any] = ()) -> Optional[sqlite3.Row]:
+        return await self.run(lambda conn: self._timed(sql, lambda: conn.execute(sql, params).fetchone()))
+
+    def insert_later(self, table: str, row: Dict[str, Any]) -> None:
+        """Queue a row to be inserted by the next batch."""
+        columns = tuple(check_identifier(c) for c in row)
+        self._pending_rows[(check_identifier(table), columns)].append(tuple(row.values()))
+        self._pending_count += 1
+
+        if self._pending_count >= self.batch_size:
+            self._start_flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_event_loop().call_later(self.batch_delay, self._start_flush)
+
+    def _start_flush(self) -> None:
+        task = asyncio.ensure_future(self.flush())
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def flush(self) -> None:
+        """Insert all queued rows, in one transaction per table and columns."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending, self._pending_rows = self._pending_rows, defaultdict(list)
+        self._pending_count = 0
+        if not pending:
+            return
+
+        def func(conn: sqlite3.Connection) -> List[Tuple[Tuple[str, Tuple[str, ...]], List[tuple]]]:
+            retry = []
+            for (table, columns), rows in pending.items():
+                sql = (f"INSERT INTO {table} ({', '.join(columns)}) "
+                       f"VALUES ({', '.join('?' * len(columns))})")
+                try:
+                    try:
+                        with conn:
+                            conn.execute('BEGIN')
+                            self._timed(sql, lambda: conn.executemany(sql, rows))
+                    except sqlite3.IntegrityError:
+                        # Insert the rows one by one, dropping only those violating a constraint
+                        dropped = self._insert_each(conn, sql, rows)
+                        logger.warning(f"Dropped {dropped} queued row(s) of {table} violating a constraint")
+                except sqlite3.Error as e:
+                    if is_transient(e):
+                        logger.warning(f"Failed to write {len(rows)} queued row(s) of {table}, retrying: {e!r}")
+                        retry.append(((table, columns), rows))
+                    else:
+                        logger.exception(f"Failed to write {len(rows)} queued row(s) of {table}: {e!r}")
+            return retry
+
+        try:
+            retry = await self.run(func)
+        except sqlite3.Error as e:
+            # No connection, e.g. the database file cannot be opened
+            if not is_transient(e):
+                logger.exception(f"Failed to write {sum(map(len, pending.values()))} queued row(s): {e!r}")
+                return
+            retry = list(pending.items())
+
+        # Before the rows queued meanwhile, keeping the order of insertion per table
+        for key, rows in retry:
+            self._pending_rows[key][:0] = rows
+            self._pending_count += len(rows)
+        if retry and self._flush_handle is None:
+            self._flush_handle = asyncio.get_event_loop().call_later(self.batch_delay, self._start_flush)
+
+    def _insert_each(self, conn: sqlite3.Connection, sql: str, rows: List[tuple]) -> int:
+        dropped = 0
+        with conn:
+            conn.execute('BEGIN')
+            for row in rows:
+                try:
+                    # A failing statement is rolled back alone, the transaction goes on
+                    self._timed(sql, lambda: conn.execute(sql, row))
+                except sqlite3.IntegrityError:
+                    dropped += 1
+        return dropped
+
+    def namespace(self, name: str) -> 'Namespace':
+        return Namespace(self, name)
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        with self._stats_lock:
+            return {sql: stats.to_dict() for sql, stats in self.stats.items()}
+
+    async def close(self) -> None:
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+        await self.flush()
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._pending_count:
+            logger.error(f"{self._pending_count} queued row(s) not written, the database is still locked")
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        for conn in self._conns:
+            conn.close()
+        self._conns.clear()
+        self._pool = queue.Queue()
+
+
+class _TableNames(dict):
+    def __init__(self, prefix: str):
+        super().__init__()
+        self.prefix = prefix
+
+    def __missing__(self, key: str) -> str:
+        return f"{self.prefix}__{check_identifier(key)}"
+
+
+class Namespace:
+    """Tables of one service, named `<service>__<table>`.
+
+    Table names are written as `{table}` in SQL, e.g. `"SELECT * FROM {users} WHERE id = ?"`.
+    """
+
+    def __init__(self, db: Database, name: str):
+        self.db = db
+        self.name = check_identifier(name)
+        self._tables = _TableNames(self.name)
+
+    def table(self, name: str) -> str:
+        return self._tables[name]
+
+    def sql(self, sql: str) -> str:
+        return sql.format_map(self._tables)
+
+    async def execute(self, sql: str, params: Sequence[Any] = ()) -> int:
+        return await self.db.execute(self.sql(sql), params)
+
+    async def executemany(self, sql: str, seq_of_params: Iterable[Sequence[Any]]) -> int:
+        return await self.db.executemany(self.sql(sql), seq_of_params)
+
+    async def fetchall(self, sql: str, params: Sequence[Any] = ()) -> List[sqlite3.Row]:
+        return await self.db.fetchall(self.sql(sql), params)
+
+    async def fetchone(self, sql: str, params: Sequence[Any] = ()) -> Optional[sqlite3.Row]:
+        return await self.db.fetchone(self.sql(sql), params)
+
+    def insert_later(self, table: str, row: Dict[str, Any]) -> None:
+        self.db.insert_later(self.table(table), row)
+
+
+database = Database()
+
+try:
+    get_driver().on_shutdown(database.close)
+except ValueError:
+    logger.warning("NoneBot is not initialized, database will not be flushed on shutdown")
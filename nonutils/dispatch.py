@@ -0,0 +1,66 @@
+import asyncio
+from collections import defaultdict
+from typing import Dict, List, Tuple, Type, Iterable, Union
+
+from loguru import logger
+from nonebot import on_message
+from nonebot.adapters import Bot, Event
+from nonebot.consts import PREFIX_KEY, CMD_KEY
+from nonebot.exception import StopPropagation
+from nonebot.matcher import Matcher, matchers
+from nonebot.message import check_and_run_matcher
+from nonebot.typing import T_State
+
+
+class CommandDispatcher:
+    """Route command messages to their matchers through one nonebot matcher per priority.
+
+    Nonebot resolves the command of every message by its prefix trie before checking matchers,
+    the dispatcher looks the resolved command up in a dict, so only the matchers of that command are
+    checked instead of every registered one. Routed matchers keep their priority and `block`:
+    each priority gets its own dispatching matcher, which runs the matchers of that priority
+    concurrently like nonebot does, and stops the propagation if one of them blocks.
+    """
+
+    def __init__(self):
+        # priority -> command -> matchers
+        self.routes: Dict[int, Dict[Tuple[str, ...], List[Type[Matcher]]]] = {}
+        self.matchers: Dict[int, Type[Matcher]] = {}
+
+    def add(self, matcher: Type[Matcher], cmds: Iterable[Union[str, Tuple[str, ...]]]) -> None:
+        """Detach `matcher` from nonebot and route `cmds` to it instead."""
+        matchers[matcher.priority].remove(matcher)
+        routes = self.routes.get(matcher.priority)
+        if routes is None:
+            routes = self.routes[matcher.priority] = defaultdict(list)
+            self.matchers[matcher.priority] = self._new_matcher(matcher.priority, routes)
+        for cmd in cmds:
+            routes[(cmd,) if isinstance(cmd, str) else cmd].append(matcher)
+
+    def remove(self, matcher: Type[Matcher]) -> None:
+        """Stop routing commands to `matcher`."""
+        routes = self.routes.get(matcher.priority, {})
+        for cmd, targets in list(routes.items()):
+            if matcher in targets:
+                targets.remove(matcher)
+                if not targets:
+                    del routes[cmd]
+
+    @staticmethod
+    def _new_matcher(priority: int, routes: Dict[Tuple[str, ...], List[Type[Matcher]]]) -> Type[Matcher]:
+        async def has_route(state: T_State) -> bool:
+            return state[PREFIX_KEY][CMD_KEY] in routes
+
+        async def dispatch(bot: Bot, event: Event, state: T_State, matcher: Matcher) -> None:
+            results = await asyncio.gather(*(check_and_run_matcher(target, bot, event, state.copy())
+                                             for target in routes[state[PREFIX_KEY][CMD_KEY]]),
+                                           return_exceptions=True)
+            for result in results:
+                if isinstance(result, StopPropagation):
+                    matcher.stop_propagation()
+                elif isinstance(result, Exception):
+                    logger.opt(exception=result).error(f"Error when dispatching {state[PREFIX_KEY][CMD_KEY]}")
+
+        dispatcher = on_message(rule=has_route, priority=priority, block=False)
+        dispatcher.append_handler(dispatch)
+        return dispatcher
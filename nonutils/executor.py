@@ -0,0 +1,99 @@
+import asyncio
+import importlib
+import inspect
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial, wraps
+from typing import Any, Callable, Dict, Optional
+
+from loguru import logger
+from nonebot import get_driver
+
+
+def _call_by_name(module: str, qualname: str, *args, **kwargs) -> Any:
+    # Decorated functions are replaced by their async wrapper, so processes look the original up through it
+    obj: Any = importlib.import_module(module)
+    for name in qualname.split('.'):
+        obj = getattr(obj, name)
+    return obj.__wrapped__(*args, **kwargs)
+
+
+class Offloader:
+    """Run blocking or CPU-heavy functions in managed thread and process pools, off the event loop."""
+
+    def __init__(self, thread_workers: Optional[int] = None, process_workers: Optional[int] = None):
+        self.thread_workers = thread_workers
+        self.process_workers = process_workers
+        self._pools: Dict[str, Executor] = {}
+
+    def get_pool(self, pool: str) -> Executor:
+        if pool not in self._pools:
+            if pool == 'thread':
+                self._pools[pool] = ThreadPoolExecutor(self.thread_workers, thread_name_prefix='nonutils-offload')
+            elif pool == 'process':
+                self._pools[pool] = ProcessPoolExecutor(self.process_workers)
+            else:
+                raise ValueError(f"Unknown pool: {pool}")
+        return self._pools[pool]
+
+    async def run(self, func: Callable[..., Any], *args,
+                  pool: str = 'thread', timeout: Optional[float] = None, **kwargs) -> Any:
+        """Run `func(*args, **kwargs)` in `pool` and wait at most `timeout` seconds for it.
+
+        If the caller is cancelled or times out, a task which has not started yet is dropped, and a
+        `threading.Event` passed as the `cancel_event` argument is set so a running thread can stop early.
+        """
+        future = asyncio.get_event_loop().run_in_executor(self.get_pool(pool), partial(func, *args, **kwargs))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            cancel_event = kwargs.get('cancel_event')
+            if isinstance(cancel_event, threading.Event):
+                cancel_event.set()
+            raise
+
+    def shutdown(self) -> None:
+        pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            pool.shutdown(wait=False)
+
+
+offloader = Offloader()
+
+try:
+    get_driver().on_shutdown(offloader.shutdown)
+except ValueError:
+    logger.warning("NoneBot is not initialized, offload pools will not be shut down on shutdown")
+
+
+def offload(pool: str = 'thread', timeout: Optional[float] = None):
+    """Turn a blocking function into a coroutine function running in `offloader`, for use in handlers:
+
+    ```python
+    @offload(timeout=10)
+    def render(text: str, cancel_event: threading.Event = None) -> bytes:
+        ...
+
+    @cmd.handle()
+    async def _(arg: Message = CommandArg()):
+        await cmd.send(MessageSegment.image(await render(str(arg))))
+    ```
+
+    A thread function with a `cancel_event` parameter gets an event which is set when the handler is
+    cancelled or times out. Process functions must be defined at module level.
+    """
+    def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+        wants_cancel_event = 'cancel_event' in inspect.signature(func).parameters
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            if pool == 'process':
+                return await offloader.run(_call_by_name, func.__module__, func.__qualname__, *args,
+                                           pool=pool, timeout=timeout, **kwargs)
+            if wants_cancel_event:
+                kwargs.setdefault('cancel_event', threading.Event())
+            return await offloader.run(func, *args, pool=pool, timeout=timeout, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,23 @@
+"""JSON parsing backed by the fastest available library.
+
+`orjson` or `ujson` is used when installed, both parse directly from bytes; otherwise falls back to `json`.
+"""
+
+try:
+    import orjson
+
+    def loads(data):
+        return orjson.loads(data)
+
+except ImportError:
+    try:
+        import ujson
+
+        def loads(data):
+            return ujson.loads(data)
+
+    except ImportError:
+        import json
+
+        def loads(data):
+            return json.loads(data)
@@ -0,0 +1,127 @@
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+def edit_distance(a: str, b: str, max_dist: Optional[int] = None) -> int:
+    """Edit distance between `a` and `b`, counting a swap of adjacent characters as one edit,
+    or `max_dist + 1` as soon as it is known to exceed `max_dist`."""
+    if len(a) < len(b):
+        a, b = b, a
+    if max_dist is not None and len(a) - len(b) > max_dist:
+        return max_dist + 1
+
+    # Matching ends never need an edit, typos usually leave little in between
+    start = 0
+    while start < len(b) and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < len(b) - start and a[-1 - end] == b[-1 - end]:
+        end += 1
+    a, b = a[start:len(a) - end], b[start:len(b) - end]
+
+    # Only cells within `max_dist` of the diagonal can lead to a distance within `max_dist`
+    band = len(a) if max_dist is None else max_dist
+    out = band + 1
+    prev2: List[int] = []
+    prev = [j if j <= band else out for j in range(len(b) + 1)]
+    prev_min = 0
+    for i in range(1, len(a) + 1):
+        ca = a[i - 1]
+        cur = [i if i <= band else out] + [out] * len(b)
+        cur_min = cur[0]
+        for j in range(max(1, i - band), min(len(b), i + band) + 1):
+            cb = b[j - 1]
+            d = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb))
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                d = min(d, prev2[j - 2] + 1)
+            cur[j] = d
+            if d < cur_min:
+                cur_min = d
+        # A swap reaches back two rows, so both must exceed `max_dist`
+        if cur_min > band and prev_min > band:
+            return out
+        prev2, prev, prev_min = prev, cur, cur_min
+    return min(prev[-1], out)
+
+
+def _char_mask(word: str) -> int:
+    mask = 0
+    for c in word:
+        mask |= 1 << (ord(c) & 63)
+    return mask
+
+
+def _bigrams(word: str) -> Counter:
+    padded = '^' + word + '$'
+    return Counter(padded[i:i + 2] for i in range(len(padded) - 1))
+
+
+class NGramIndex:
+    """Index of words searchable by edit distance.
+
+    A word padded with `^` and `$` has `len + 1` bigrams and every edit changes at most three of them,
+    so words within `max_dist` of a query share at least `max(len) + 1 - 3 * max_dist` bigrams with it.
+    Counting shared bigrams through an inverted index, split by word length, then comparing the sets
+    of characters (an edit adds or removes at most two) leaves only a few candidates to compute
+    the exact distance of, instead of every word.
+    """
+
+    def __init__(self):
+        self._words: List[str] = []
+        self._masks: List[int] = []
+        self._ids: Dict[str, int] = {}
+        # (word length, bigram) -> [(word id, occurrences in the word)]
+        self._postings: Dict[Tuple[int, str], List[Tuple[int, int]]] = defaultdict(list)
+        self._by_length: Dict[int, List[int]] = defaultdict(list)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, word: str) -> bool:
+        return word in self._ids
+
+    def add(self, word: str) -> None:
+        if word in self._ids:
+            return
+        word_id = self._ids[word] = len(self._words)
+        self._words.append(word)
+        self._masks.append(_char_mask(word))
+        for gram, count in _bigrams(word).items():
+            self._postings[(len(word), gram)].append((word_id, count))
+        self._by_length[len(word)].append(word_id)
+
+    def discard(self, word: str) -> None:
+        # The slot of the word in `_words` is left unused
+        word_id = self._ids.pop(word, None)
+        if word_id is None:
+            return
+        for gram in _bigrams(word):
+            key = (len(word), gram)
+            self._postings[key] = [posting for posting in self._postings[key] if posting[0] != word_id]
+        self._by_length[len(word)].remove(word_id)
+
+    def search(self, word: str, max_dist: int) -> List[Tuple[int, str]]:
+        """Words within `max_dist` of `word`, as `(distance, word)` sorted by distance then word."""
+        grams = _bigrams(word)
+        mask = _char_mask(word)
+        found = []
+        for length in range(max(len(word) - max_dist, 0), len(word) + max_dist + 1):
+            threshold = max(length, len(word)) + 1 - 3 * max_dist
+            if threshold <= 0:
+                # Very short words may be within reach without sharing any bigram
+                candidates: Iterable[int] = self._by_length.get(length, ())
+            else:
+                shared: Dict[int, int] = defaultdict(int)
+                for gram, count in grams.items():
+                    for word_id, n in self._postings.get((length, gram), ()):
+                        shared[word_id] += min(count, n)
+                candidates = [word_id for word_id, n in shared.items() if n >= threshold]
+
+            for word_id in candidates:
+                if bin(mask ^ self._masks[word_id]).count('1') > 2 * max_dist:
+                    continue
+                dist = edit_distance(word, self._words[word_id], max_dist)
+                if dist <= max_dist:
+                    found.append((dist, self._words[word_id]))
+        found.sort()
+        return found
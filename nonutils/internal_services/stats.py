@@ -0,0 +1,23 @@
+from nonebot.permission import SUPERUSER
+
+from nonutils.command import Command
+from nonutils.metrics import metrics
+from nonutils.session import sessions
+from nonutils.stringres import strings
+
+
+stats_cmd = Command('stats', hidden=True, permission=SUPERUSER, desc='查看运行统计',
+                    usage='按 P95 延迟从高到低，列出命令与 API 的调用统计，以及多轮会话的统计。')
+
+
+@stats_cmd.handle()
+async def _():
+    res = strings.for_event()
+    snapshot = sorted(metrics.snapshot().items(), key=lambda item: item[1]['p95'], reverse=True)
+    stats_list = [
+        res.FORMAT_STATS_LIST.format(name=name, calls=s['calls'], errors=s['errors'], p95=s['p95'] * 1000)
+        for name, s in snapshot[:20]
+    ]
+    await stats_cmd.send(res.MSG_STATS.format(stats_list='\n'.join(stats_list) if stats_list
+                                                          else res.EXPR_NOT_AVAILABLE,
+                                               **sessions.get_stats()))
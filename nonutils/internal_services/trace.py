@@ -0,0 +1,44 @@
+from datetime import datetime
+
+from nonebot.adapters import Message
+from nonebot.params import CommandArg
+from nonebot.permission import SUPERUSER
+
+from nonutils.command import Command
+from nonutils.stringres import FULL_SPACE, strings
+from nonutils.tracing import tracer
+
+
+trace_cmd = Command('trace', hidden=True, permission=SUPERUSER, desc='查看错误追踪',
+                    usage='列出最近出现最多的错误，或按签名、追踪ID查看错误的详细信息。')
+
+
+def _format_time(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp).strftime('%m-%d %H:%M:%S')
+
+
+@trace_cmd.handle()
+async def _(args: Message = CommandArg()):
+    arg = args.extract_plain_text().strip()
+    res = strings.for_event()
+
+    if not arg:
+        failure_list = [
+            res.FORMAT_TRACE_LIST.format(signature=s.signature, count=s.count, last_seen=_format_time(s.last_seen),
+                                         source=s.source, error=s.error)
+            for s in tracer.top()
+        ]
+        await trace_cmd.send(res.MSG_TRACE.format(failure_list='\n'.join(failure_list) if failure_list
+                                                  else res.EXPR_NOT_AVAILABLE,
+                                                  **tracer.get_stats()))
+        return
+
+    sig = tracer.find(arg)
+    if sig is None:
+        await trace_cmd.send_failure(res.MSG_TRACE_NOT_FOUND.format(key=arg))
+        return
+    await trace_cmd.send(res.MSG_TRACE_DETAIL.format(
+        signature=sig.signature, source=sig.source, error=sig.error, count=sig.count,
+        first_seen=_format_time(sig.first_seen), last_seen=_format_time(sig.last_seen),
+        trace_ids='\n'.join(FULL_SPACE + t for t in sig.trace_ids) or res.EXPR_NOT_AVAILABLE,
+        stack='\n'.join(FULL_SPACE + frame for frame in sig.stack) or res.EXPR_NOT_AVAILABLE))
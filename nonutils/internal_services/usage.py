@@ -1,8 +1,8 @@
-from nonebot import Bot
-from nonebot.adapters import Event
+from nonebot.adapters import Message
+from nonebot.params import CommandArg
 
 from nonutils.command import Command, cmdmgr
-from nonutils.stringres import Rstr
+from nonutils.stringres import strings
 
 
 usage_cmd = Command('help', aliases={'usage'}, desc='查看帮助',
@@ -10,28 +10,21 @@ usage_cmd = Command('help', aliases={'usage'}, desc='查看帮助',
 
 
 @usage_cmd.handle()
-async def _(bot: Bot, event: Event):
+async def _(args: Message = CommandArg()):
+    arg = args.extract_plain_text().strip()
+    res = strings.for_event()
 
-    cmd_list = [
-        Rstr.FORMAT_CMDS_LIST.format(
-            cmd=c.cmd,
-            desc=(c.desc if c.desc else '')
-        )
-        for c in cmdmgr.get_all_cmds(exclude_hidden_cmd=True)
-    ]
-
-    if cmd_list:
-        cmd_list_str = '\n'.join(cmd_list).strip()
-    else:
-        cmd_list_str = Rstr.EXPR_NO_CMDS
-
-    arg = event.get_message().extract_plain_text()
-
-    if not arg:
-        await usage_cmd.send(Rstr.MSG_MAIN_USAGE_DOC.format(cmd_list=cmd_list_str))
+    if not arg or arg.isdigit():
+        await usage_cmd.send(cmdmgr.get_help_page(int(arg) if arg else 1, res.locale))
     else:
-        cmd_obj = cmdmgr.fetch_cmd(arg)
-        if cmd_obj:
-            await usage_cmd.send(Rstr.MSG_CMD_USAGE.format(cmd=arg, usage=cmd_obj.get_usage_str()))
+        usage = cmdmgr.get_cmd_usage(arg, res.locale)
+        if usage:
+            await usage_cmd.send(usage)
+            return
+
+        suggestions = cmdmgr.suggest(arg)
+        if suggestions:
+            await usage_cmd.send_failure(res.MSG_UNKNOWN_CMD_SUGGEST.format(
+                cmd=arg, suggestions='、'.join(res.FORMAT_SUGGESTION.format(name=name) for name in suggestions)))
         else:
-            await usage_cmd.send_failure(Rstr.MSG_UNKNOWN_CMD.format(cmd=arg))
+            await usage_cmd.send_failure(res.MSG_UNKNOWN_CMD.format(cmd=arg))
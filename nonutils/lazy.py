@@ -0,0 +1,36 @@
+from typing import Callable, Generic, TypeVar
+
+T = TypeVar('T')
+
+
+class LazyObject(Generic[T]):
+    """Proxy building its object by `factory` on first attribute access.
+
+    Settings are read from the environment and files when built, which is better done
+    once the bot starts than while plugins are imported:
+
+    ```python
+    pref: MyPref = LazyObject(lambda: MyPref('my_pref'))  # type: ignore
+    ```
+    """
+
+    def __init__(self, factory: Callable[[], T]):
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_obj', None)
+
+    def _load(self) -> T:
+        obj = object.__getattribute__(self, '_obj')
+        if obj is None:
+            obj = object.__getattribute__(self, '_factory')()
+            object.__setattr__(self, '_obj', obj)
+        return obj
+
+    def __getattr__(self, name: str):
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name: str, value) -> None:
+        setattr(self._load(), name, value)
+
+    def __repr__(self):
+        obj = object.__getattribute__(self, '_obj')
+        return f"<LazyObject {'(not loaded)' if obj is None else repr(obj)}>"
@@ -0,0 +1,145 @@
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, deque
+from typing import Any, Deque, Dict, Hashable, List, Optional
+
+# Upper bounds of latency buckets, in seconds
+LATENCY_BUCKETS = (.001, .002, .005, .01, .02, .05, .1, .2, .5, 1., 2., 5., 10., float('inf'))
+
+
+class Histogram:
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def record(self, value: float) -> None:
+        self.counts[bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percentile: float) -> float:
+        """Upper bound of the bucket holding the given percentile."""
+        rank = self.count * percentile / 100
+        seen = 0
+        for bound, n in zip(LATENCY_BUCKETS, self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(bound, self.max)
+        return 0.
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'avg': self.total / self.count if self.count else 0.,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': self.max,
+            'buckets': {str(bound): n for bound, n in zip(LATENCY_BUCKETS, self.counts) if n},
+        }
+
+
+class Series:
+    __slots__ = ('calls', 'errors', 'latency')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.latency = Histogram()
+
+
+class SamplingProfiler:
+    """Sample the stack of the event loop thread every `interval` seconds while handlers are being profiled.
+
+    Handlers share the loop thread, so a sample is added to the profile of every handler running at that moment.
+    """
+
+    def __init__(self, interval: float = .005, max_depth: int = 32):
+        self.interval = interval
+        self.max_depth = max_depth
+
+        self._samples: Dict[Hashable, Counter] = {}
+        self._thread_id: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def begin(self, key: Hashable) -> None:
+        self._samples[key] = Counter()
+        if self._thread is None:
+            self._thread_id = threading.get_ident()
+            self._thread = threading.Thread(target=self._run, name='nonutils-profiler', daemon=True)
+            self._thread.start()
+
+    def end(self, key: Hashable) -> Optional[Counter]:
+        return self._samples.pop(key, None)
+
+    def _run(self) -> None:
+        while self._samples:
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None:
+                stack: List[str] = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_filename}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                collapsed = ';'.join(reversed(stack))
+                for samples in list(self._samples.values()):
+                    samples[collapsed] += 1
+            time.sleep(self.interval)
+        self._thread = None
+
+
+class Metrics:
+    """Invocation counts, error counts and latency histograms of commands and API calls.
+
+    Set `profile_threshold` (seconds) to sample the stack of every handler,
+    and keep the profiles of the ones slower than the threshold in `slow_profiles`.
+    """
+
+    def __init__(self, max_slow_profiles: int = 20):
+        self.series: Dict[str, Series] = {}
+
+        self.profile_threshold: Optional[float] = None
+        self.profiler = SamplingProfiler()
+        self.slow_profiles: Deque[Dict[str, Any]] = deque(maxlen=max_slow_profiles)
+
+    def record(self, name: str, elapsed: float, error: bool = False) -> None:
+        series = self.series.get(name)
+        if series is None:
+            series = self.series[name] = Series()
+        series.calls += 1
+        if error:
+            series.errors += 1
+        series.latency.record(elapsed)
+
+    def begin_profile(self, key: Hashable) -> None:
+        if self.profile_threshold is not None:
+            self.profiler.begin(key)
+
+    def end_profile(self, key: Hashable, name: str, elapsed: float) -> None:
+        samples = self.profiler.end(key)
+        if samples is not None and self.profile_threshold is not None and elapsed >= self.profile_threshold:
+            self.slow_profiles.append({
+                'name': name,
+                'elapsed': elapsed,
+                'time': time.time(),
+                # Collapsed stacks, root first, as used by flame graph tools
+                'stacks': dict(samples.most_common(50)),
+            })
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {name: {'calls': s.calls, 'errors': s.errors, **s.latency.to_dict()}
+                for name, s in self.series.items()}
+
+    def reset(self) -> None:
+        self.series.clear()
+        self.slow_profiles.clear()
+
+
+metrics = Metrics()
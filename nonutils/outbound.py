@@ -0,0 +1,126 @@
+import asyncio
+from functools import reduce
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from loguru import logger
+from nonebot import get_driver
+from nonebot.adapters import Bot, Event, Message, MessageSegment
+from nonebot.matcher import current_bot, current_event
+
+from nonutils.ratelimit import TokenBucket
+
+
+def get_chat_id(event: Event) -> str:
+    group_id = getattr(event, 'group_id', None)
+    return f'group_{group_id}' if group_id is not None else event.get_session_id()
+
+
+class _ChatQueue:
+    def __init__(self, bot: Bot, max_pending: int):
+        self.bot = bot
+        self.queue: 'asyncio.Queue[Tuple[Event, Any, Dict[str, Any]]]' = asyncio.Queue(max_pending)
+        self.worker: Optional[asyncio.Future] = None
+
+
+class OutboundQueue:
+    """Per-chat outbound queue for `Command.send*`.
+
+    Messages sent to the same chat within `merge_window` seconds are merged into one message,
+    and every send waits for a token of both its bot and its chat. When `max_pending` messages of a chat
+    are waiting, further sends wait for room instead of being dropped.
+    Buckets are dropped once full again after their chat is idle, so only recently active chats are kept.
+    """
+
+    def __init__(self, merge_window: float = 0.3, max_pending: int = 32, separator: str = '\n',
+                 bot_rate: float = 20., bot_burst: int = 20, chat_rate: float = 1., chat_burst: int = 5):
+        self.enabled = False
+
+        self.merge_window = merge_window
+        self.max_pending = max_pending
+        self.separator = separator
+        self.bot_rate = bot_rate
+        self.bot_burst = bot_burst
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+
+        self._chats: Dict[Tuple[str, str], _ChatQueue] = {}
+        self._bot_buckets: Dict[str, TokenBucket] = {}
+        self._chat_buckets: Dict[Tuple[str, str], TokenBucket] = {}
+
+    async def put(self, message: Union[str, Message, MessageSegment], **kwargs: Any) -> None:
+        """Queue a message to the chat of the current event, waiting while the queue is full."""
+        bot, event = current_bot.get(), current_event.get()
+        key = (bot.self_id, get_chat_id(event))
+
+        chat = self._chats.get(key)
+        if chat is None:
+            chat = self._chats[key] = _ChatQueue(bot, self.max_pending)
+        await chat.queue.put((event, message, kwargs))
+        if chat.worker is None:
+            # The worker may have exited while we were waiting for room
+            self._chats[key] = chat
+            chat.worker = asyncio.ensure_future(self._work(key, chat))
+
+    async def _work(self, key: Tuple[str, str], chat: _ChatQueue) -> None:
+        pending: List[Tuple[Event, Any, Dict[str, Any]]] = []
+        try:
+            while pending or not chat.queue.empty():
+                if not pending:
+                    pending.append(chat.queue.get_nowait())
+                    await asyncio.sleep(self.merge_window)
+
+                event, _, kwargs = pending[0]
+                while not chat.queue.empty():
+                    pending.append(chat.queue.get_nowait())
+
+                # Only consecutive messages with the same send arguments are merged
+                batch = []
+                while pending and pending[0][2] == kwargs:
+                    batch.append(pending.pop(0)[1])
+
+                await self._get_bucket(self._bot_buckets, key[0], self.bot_rate, self.bot_burst).acquire()
+                await self._get_bucket(self._chat_buckets, key, self.chat_rate, self.chat_burst).acquire()
+                try:
+                    await chat.bot.send(event, reduce(lambda a, b: a + self.separator + b, batch), **kwargs)
+                except Exception as e:
+                    logger.exception(f"Failed to send {len(batch)} queued message(s) to {key}: {e!r}")
+        finally:
+            chat.worker = None
+            if self._chats.get(key) is chat:
+                del self._chats[key]
+            self._drop_when_full(self._chat_buckets, key)
+            self._drop_when_full(self._bot_buckets, key[0])
+
+    @staticmethod
+    def _get_bucket(buckets: Dict[Any, TokenBucket], key: Any, rate: float, burst: int) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(rate, burst)
+        return bucket
+
+    def _drop_when_full(self, buckets: Dict[Any, TokenBucket], key: Any, reschedule: bool = True) -> None:
+        # A new bucket starts full, so dropping a full one changes nothing. If it is still in use when checked again,
+        # the worker using it checks it again when it exits
+        bucket = buckets.get(key)
+        if bucket is None:
+            return
+        wait = bucket.time_to_full()
+        if wait <= 0:
+            del buckets[key]
+        elif reschedule:
+            # A bit later, as timers may run up to the clock resolution early
+            asyncio.get_event_loop().call_later(wait + 0.05, self._drop_when_full, buckets, key, False)
+
+    async def close(self) -> None:
+        """Wait for all queued messages to be sent."""
+        workers = [chat.worker for chat in self._chats.values() if chat.worker is not None]
+        if workers:
+            await asyncio.gather(*workers, return_exceptions=True)
+
+
+outbound = OutboundQueue()
+
+try:
+    get_driver().on_shutdown(outbound.close)
+except ValueError:
+    logger.warning("NoneBot is not initialized, queued messages will not be sent on shutdown")
@@ -1,37 +1,262 @@
+import atexit
+import copy
 import json
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Iterator, Optional, Type, TypeVar, Generic, Tuple
 
-from pydantic import BaseSettings
+from loguru import logger
+from pydantic import BaseSettings, BaseModel, validate_model
 
 pref_dir: Path = Path("preferences")
 
-def json_config_settings_source(pref: 'Preference') -> Dict[str, Any]:
-    if pref._perf_path.exists():
-        return json.loads(pref._perf_path.read_text(encoding='utf-8'))
-    else:
+# path -> (mtime_ns, size, parsed content), shared by all preferences of the process
+_file_cache: Dict[Path, Tuple[int, int, Dict[str, Any]]] = {}
+_file_cache_lock = threading.Lock()
+
+
+def _stat_key(path: Path) -> Optional[Tuple[int, int]]:
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def load_pref_file(path: Path) -> Dict[str, Any]:
+    """Read a preference file, reparsing it only if its mtime or size changed since the last read."""
+    key = _stat_key(path)
+    if key is None:
         return {}
+    with _file_cache_lock:
+        cached = _file_cache.get(path)
+    if cached is None or cached[:2] != key:
+        data = json.loads(path.read_text(encoding='utf-8'))
+        with _file_cache_lock:
+            _file_cache[path] = (*key, data)
+    else:
+        data = cached[2]
+    return copy.deepcopy(data)
+
+
+def json_config_settings_source(pref: 'Preference') -> Dict[str, Any]:
+    # Changes of another instance of the same file must be read back
+    pref_writer.flush_path(pref._perf_path)
+    return load_pref_file(pref._perf_path)
+
+
+def atomic_write_text(path: Path, text: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + '.tmp')
+    tmp_path.write_text(text, encoding='utf-8')
+    os.replace(tmp_path, path)
+
+
+class PreferenceWriter:
+    """Write changed preferences from a background thread.
+
+    A preference is written `delay` seconds after its first unsaved change,
+    so all changes made within that window are saved by a single write.
+    The last instance changed is written if several share a file, and a failed write is retried.
+    """
+
+    def __init__(self, delay: float = 1.):
+        self.delay = delay
+
+        self._pending: Dict[Path, 'Preference'] = {}
+        self._deadlines: Dict[Path, float] = {}
+        self._cond = threading.Condition()
+        self._io_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def schedule(self, pref: 'Preference') -> None:
+        with self._cond:
+            if pref._perf_path in self._pending:
+                self._pending[pref._perf_path] = pref
+                return
+            self._pending[pref._perf_path] = pref
+            self._deadlines[pref._perf_path] = time.monotonic() + self.delay
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='nonutils-pref-writer', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _write(self, pref: 'Preference') -> None:
+        with self._io_lock:
+            try:
+                text = pref.json()
+                atomic_write_text(pref._perf_path, text)
+                # Remember our own write, so the watcher does not reload it
+                with _file_cache_lock:
+                    _file_cache[pref._perf_path] = (*_stat_key(pref._perf_path), json.loads(text))
+            except Exception as e:
+                # e.g. a handler changing a nested field while it is serialized
+                logger.exception(f"Failed to save preference {pref._perf_path}, retrying: {e!r}")
+                self.schedule(pref)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                # All entries share the same delay, so the first one is due first
+                path = next(iter(self._pending))
+                wait = self._deadlines[path] - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                pref = self._pending.pop(path)
+                del self._deadlines[path]
+            self._write(pref)
+
+    def is_pending(self, pref: 'Preference') -> bool:
+        return pref._perf_path in self._pending
+
+    def flush(self, pref: Optional['Preference'] = None) -> None:
+        """Write pending changes of `pref`, or of all preferences, right now in the calling thread."""
+        if pref is not None:
+            self.flush_path(pref._perf_path)
+            return
+        with self._cond:
+            prefs = list(self._pending.values())
+            self._pending.clear()
+            self._deadlines.clear()
+        for p in prefs:
+            self._write(p)
+
+    def flush_path(self, path: Path) -> None:
+        """Write the pending changes of the preference stored at `path`, if any."""
+        with self._cond:
+            pref = self._pending.pop(path, None)
+            if pref is None:
+                return
+            del self._deadlines[path]
+        self._write(pref)
+
+
+pref_writer = PreferenceWriter()
+atexit.register(pref_writer.flush)
+
+
+class PreferenceWatcher:
+    """Poll the files of live preferences every `interval` seconds,
+    and reload files edited outside the bot into their `Preference` objects."""
+
+    def __init__(self, interval: float = 2.):
+        self.interval = interval
+
+        # Models are unhashable, so keyed by id
+        self.prefs: 'weakref.WeakValueDictionary[int, Preference]' = weakref.WeakValueDictionary()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='nonutils-pref-watcher', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def check(self) -> None:
+        changed: Dict[Path, Optional[Dict[str, Any]]] = {}
+        for pref in list(self.prefs.values()):
+            path = pref._perf_path
+            if path not in changed:
+                changed[path] = None
+                key = _stat_key(path)
+                with _file_cache_lock:
+                    cached = _file_cache.get(path)
+                if key is not None and (cached is None or cached[:2] != key):
+                    try:
+                        changed[path] = load_pref_file(path)
+                    except ValueError as e:
+                        logger.warning(f"Failed to reload preference {path}: {e!r}")
+
+            # Unsaved changes win over the file, which they will overwrite soon
+            if changed[path] is not None and not pref_writer.is_pending(pref):
+                self.reload(pref, changed[path])
+
+    @staticmethod
+    def reload(pref: 'Preference', data: Dict[str, Any]) -> None:
+        values, _, error = validate_model(type(pref), data)
+        if error:
+            logger.warning(f"Invalid preference {pref._perf_path}, not reloaded: {error}")
+            return
+        # Bypass `Preference.__setattr__`, the values come from the file and need no saving
+        pref.__dict__.update({k: v for k, v in values.items() if k in data})
+        logger.info(f"Reloaded preference {pref._perf_path}")
 
-class Preference(BaseSettings):
+
+pref_watcher = PreferenceWatcher()
+
+
+class _WeakRefSlot:
+    # Pydantic models with private attributes get `__slots__` without `__weakref__`
+    __slots__ = ('__weakref__',)
+
+
+class Preference(BaseSettings, _WeakRefSlot):
     _initialized = False
+    _batch_depth = 0
+    _dirty = False
     _perf_path: Path
 
-    def __dump(self):
-        self._perf_path.write_text(self.json(), encoding='utf-8')
-
     def __init__(self, pref_name: str, *args, **kwargs):
         self._perf_path = pref_dir / f"{pref_name}.json"
-        pref_dir.mkdir(parents=True, exist_ok=True)
 
         super().__init__(*args, **kwargs)
 
+        # Nothing is written until a field is changed
         self._initialized = True
+        pref_watcher.prefs[id(self)] = self
+
+    def _mark_dirty(self) -> None:
+        self._dirty = True
+        if not self._batch_depth:
+            self._dirty = False
+            pref_writer.schedule(self)
 
     def __setattr__(self, name, value):
-        # Dump preference when a attr is changed
+        # Save preference when a field is changed
         super().__setattr__(name, value)
-        if getattr(self, '_initialized', False):
-            self.__dump()
+        if not name.startswith('_') and getattr(self, '_initialized', False):
+            self._mark_dirty()
+
+    def flush(self) -> None:
+        """Write unsaved changes to disk right now."""
+        pref_writer.flush(self)
+
+    @contextmanager
+    def batch(self) -> Iterator['Preference']:
+        """Group several changes into one write:
+
+        ```python
+        with pref.batch():
+            pref.a = 1
+            pref.b = 2
+        ```
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth and self._dirty:
+                self._mark_dirty()
 
     class Config:
         underscore_attrs_are_private = True
@@ -50,3 +275,132 @@ class Preference(BaseSettings):
                 file_secret_settings,
             )
 
+
+class ScopedPreference(BaseModel):
+    """Preference model stored once per scope (e.g. per group or per user) in a `ScopedPreferenceStore`."""
+    _store: Optional['ScopedPreferenceStore'] = None
+    _scope: str = ''
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if not name.startswith('_') and self._store is not None:
+            self._store.mark_dirty(self)
+
+    class Config:
+        underscore_attrs_are_private = True
+
+
+T_ScopedPreference = TypeVar('T_ScopedPreference', bound=ScopedPreference)
+
+
+class ScopedPreferenceStore(Generic[T_ScopedPreference]):
+    """Store many `ScopedPreference`s of the same model in a single SQLite file.
+
+    Scopes are loaded on first access and kept in an LRU cache of `cache_size` entries,
+    changes are written in one transaction `flush_delay` seconds after the first unsaved change.
+
+    ```python
+    class GroupPref(ScopedPreference):
+        welcome: bool = True
+
+    group_prefs = ScopedPreferenceStore(GroupPref, 'group')
+    group_prefs[str(event.group_id)].welcome = False
+    ```
+    """
+
+    def __init__(self, model: Type[T_ScopedPreference], pref_name: str,
+                 db_path: Optional[Path] = None, cache_size: int = 1024, flush_delay: float = 1.):
+        self.model = model
+        self.pref_name = pref_name
+        self.cache_size = cache_size
+        self.flush_delay = flush_delay
+
+        if db_path is None:
+            pref_dir.mkdir(parents=True, exist_ok=True)
+            db_path = pref_dir / 'scoped.db'
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS scoped_preferences ('
+                           'name TEXT NOT NULL, scope TEXT NOT NULL, data TEXT NOT NULL, '
+                           'PRIMARY KEY (name, scope)) WITHOUT ROWID')
+        self._db_lock = threading.Lock()
+        # Loads use their own connection, so they never wait for a flush (WAL lets them read concurrently)
+        self._read_conn = sqlite3.connect(str(db_path), check_same_thread=False, isolation_level=None)
+        self._read_lock = threading.Lock()
+
+        self._cache: 'OrderedDict[str, T_ScopedPreference]' = OrderedDict()
+        # Dirty scopes are kept here until flushed, even if evicted from the cache
+        self._dirty: Dict[str, T_ScopedPreference] = {}
+        # Scopes being flushed, until committed, so a load does not read their old rows meanwhile
+        self._inflight: Dict[str, T_ScopedPreference] = {}
+        self._dirty_lock = threading.Lock()
+        self._flush_timer: Optional[threading.Timer] = None
+
+        atexit.register(self.flush)
+
+    def __getitem__(self, scope: str) -> T_ScopedPreference:
+        return self.get(scope)
+
+    def get(self, scope: str) -> T_ScopedPreference:
+        pref = self._cache.get(scope)
+        if pref is not None:
+            self._cache.move_to_end(scope)
+            return pref
+
+        pref = self._dirty.get(scope) or self._inflight.get(scope) or self._load(scope)
+        self._cache[scope] = pref
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return pref
+
+    def _load(self, scope: str) -> T_ScopedPreference:
+        with self._read_lock:
+            row = self._read_conn.execute('SELECT data FROM scoped_preferences WHERE name = ? AND scope = ?',
+                                     (self.pref_name, scope)).fetchone()
+        pref = self.model.parse_raw(row[0]) if row else self.model()
+        pref._scope = scope
+        pref._store = self
+        return pref
+
+    def mark_dirty(self, pref: T_ScopedPreference) -> None:
+        with self._dirty_lock:
+            self._dirty[pref._scope] = pref
+            self._schedule_flush()
+
+    def _schedule_flush(self) -> None:
+        # Called with `_dirty_lock` held
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(self.flush_delay, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def flush(self) -> None:
+        """Write all unsaved scopes in a single transaction."""
+        # One flush at a time, so an older snapshot is never committed over a newer one
+        with self._db_lock:
+            with self._dirty_lock:
+                # Moved to `_inflight` before leaving `_dirty`, so `get` always finds them in one of both
+                self._inflight = dict(self._dirty)
+                dirty, self._dirty = self._dirty, {}
+                if self._flush_timer is not None:
+                    self._flush_timer.cancel()
+                    self._flush_timer = None
+            if not dirty:
+                return
+
+            try:
+                rows = [(self.pref_name, scope, pref.json()) for scope, pref in dirty.items()]
+                with self._conn:
+                    self._conn.execute('BEGIN')
+                    self._conn.executemany('INSERT OR REPLACE INTO scoped_preferences (name, scope, data) '
+                                           'VALUES (?, ?, ?)', rows)
+            except (sqlite3.Error, RuntimeError) as e:
+                # RuntimeError: a handler changed a nested field while it was serialized
+                logger.exception(f"Failed to save scoped preference '{self.pref_name}', retrying: {e!r}")
+                with self._dirty_lock:
+                    for scope, pref in dirty.items():
+                        self._dirty.setdefault(scope, pref)
+                    self._schedule_flush()
+            finally:
+                # Committed (or back in `_dirty`), loads may read the rows again
+                self._inflight = {}
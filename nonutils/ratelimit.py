@@ -0,0 +1,76 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Hashable
+
+
+class TokenBucket:
+    """Async token bucket, refilled at `rate` tokens per second up to `burst` tokens.
+
+    Waiters reserve their token up front, so they are served in FIFO order without holding a lock.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def try_acquire(self) -> bool:
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def time_to_full(self) -> float:
+        """Seconds until the bucket is full again, 0 if it is."""
+        self._refill()
+        return max(0., (self.burst - self._tokens) / self.rate)
+
+    async def acquire(self) -> None:
+        self._refill()
+        self._tokens -= 1
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self.rate)
+
+
+class CooldownTracker:
+    """Remember the last trigger time of each key for `cooldown` seconds.
+
+    Keys are kept in trigger order, so expired keys are dropped from the front,
+    and at most `max_entries` keys are kept at all, evicting the least recent ones.
+    """
+
+    def __init__(self, cooldown: float, max_entries: int = 65536):
+        self.cooldown = cooldown
+        self.max_entries = max_entries
+
+        self._triggered: 'OrderedDict[Hashable, float]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._triggered)
+
+    def hit(self, key: Hashable) -> float:
+        """Record a trigger of `key` and return 0, or return the remaining seconds if it is cooling down."""
+        now = time.monotonic()
+        while self._triggered:
+            oldest_key, triggered_at = next(iter(self._triggered.items()))
+            if now - triggered_at < self.cooldown:
+                break
+            del self._triggered[oldest_key]
+
+        triggered_at = self._triggered.get(key)
+        if triggered_at is not None:
+            return self.cooldown - (now - triggered_at)
+
+        self._triggered[key] = now
+        if len(self._triggered) > self.max_entries:
+            self._triggered.popitem(last=False)
+        return 0.
@@ -0,0 +1,187 @@
+import asyncio
+import heapq
+import itertools
+import sys
+import time
+import weakref
+from collections import OrderedDict, deque
+from contextlib import suppress
+from datetime import datetime, timedelta
+from typing import Any, Deque, Dict, List, Optional, Tuple, Type
+
+from loguru import logger
+from nonebot import get_driver
+from nonebot.adapters import Bot, Event
+from nonebot.matcher import Matcher, matchers
+from nonebot.typing import T_State
+
+from nonutils.stringres import strings
+
+
+def _estimate_size(state: T_State) -> int:
+    """Rough size of a session state: the dict and its direct keys and values."""
+    return sys.getsizeof(state) + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in state.items())
+
+
+class _Session:
+    __slots__ = ('matcher', 'owner', 'bot', 'event', 'deadline', 'size')
+
+    def __init__(self, matcher: Type[Matcher], owner: Any, bot: Bot, event: Event,
+                 deadline: Optional[float], size: int):
+        self.matcher = matcher
+        self.owner = owner
+        self.bot = bot
+        self.event = event
+        self.deadline = deadline
+        self.size = size
+
+
+class SessionStore:
+    """Bound the multi-turn sessions of commands waiting for the user to reply.
+
+    When a handler pauses, rejects or waits in `got` / `receive`, nonebot keeps its state in a temporary
+    matcher until the user replies. The store tracks these matchers for commands of `cmdmgr`, ends them
+    after the `session_ttl` of their command (`default_ttl` if unset), and evicts the least recently
+    active ones beyond `max_sessions` or `max_bytes` of state. The user is told when their session ends,
+    by the sweeper task every `sweep_interval` seconds, so commands never wait for these messages.
+    """
+
+    def __init__(self, default_ttl: Optional[float] = None, max_sessions: int = 10000,
+                 max_bytes: int = 64 << 20, sweep_interval: float = 5.):
+        self.default_ttl = default_ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+
+        self._sessions: 'OrderedDict[Type[Matcher], _Session]' = OrderedDict()
+        # Temporary matcher -> its command or switch, kept for as long as the matcher class lives
+        self._owners: 'weakref.WeakKeyDictionary[Type[Matcher], Any]' = weakref.WeakKeyDictionary()
+        self._bytes = 0
+        # (deadline, seq, matcher), entries of sessions resumed or ended meanwhile are skipped when popped
+        self._deadlines: List[Tuple[float, int, Type[Matcher]]] = []
+        self._seq = itertools.count()
+        # Ended sessions whose user is still to be told
+        self._notices: Deque[_Session] = deque(maxlen=max_sessions)
+        self._wake: Optional[asyncio.Event] = None
+        self._sweep_task: Optional[asyncio.Task] = None
+
+        self.created = 0
+        self.resumed = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get_owner(self, matcher: Type[Matcher]) -> Any:
+        return self._owners.get(matcher)
+
+    def track(self, matcher: Matcher, owner: Any, bot: Bot, event: Event) -> None:
+        """Track the temporary matcher left behind if `matcher` paused.
+
+        Must be called right after `Matcher.run` returns, when that matcher is the last one of priority 0.
+        """
+        waiting = matchers.get(0)
+        new = waiting[-1] if waiting else None
+        if new is None or new._default_state is not matcher.state or new in self._sessions:
+            return
+
+        ttl = getattr(owner, 'session_ttl', None) or self.default_ttl
+        if ttl is not None:
+            new.expire_time = datetime.now() + timedelta(seconds=ttl)
+            deadline = time.monotonic() + ttl
+        elif new.expire_time is not None:
+            deadline = time.monotonic() + (new.expire_time - datetime.now()).total_seconds()
+        else:
+            deadline = None
+
+        session = _Session(new, owner, bot, event, deadline, _estimate_size(matcher.state))
+        self._sessions[new] = session
+        self._owners[new] = owner
+        self._bytes += session.size
+        self.created += 1
+        if deadline is not None:
+            heapq.heappush(self._deadlines, (deadline, next(self._seq), new))
+
+        while self._sessions and (len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes):
+            self._end(next(iter(self._sessions.values())), evicted=True)
+
+    def resume(self, matcher: Type[Matcher]) -> None:
+        """Stop tracking the temporary matcher `matcher`, nonebot is running it for the reply of the user."""
+        session = self._sessions.pop(matcher, None)
+        if session is not None:
+            self._bytes -= session.size
+            self.resumed += 1
+
+    def expire(self) -> None:
+        """End the sessions past their TTL."""
+        now = time.monotonic()
+        while self._deadlines and self._deadlines[0][0] <= now:
+            deadline, _, matcher = heapq.heappop(self._deadlines)
+            session = self._sessions.get(matcher)
+            if session is not None and session.deadline == deadline:
+                self._end(session)
+
+    def _end(self, session: _Session, evicted: bool = False) -> None:
+        del self._sessions[session.matcher]
+        self._bytes -= session.size
+        if evicted:
+            self.evicted += 1
+        else:
+            self.expired += 1
+        with suppress(ValueError):
+            session.matcher.destroy()
+
+        self._notices.append(session)
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _notify(self) -> None:
+        while self._notices:
+            session = self._notices.popleft()
+            try:
+                res = strings.for_event(session.event)
+                await session.bot.send(session.event, res.FORMAT_WARNING_MSG.format(
+                    cmd=session.owner.get_name_str(), msg=res.MSG_SESSION_EXPIRED))
+            except Exception as e:
+                logger.warning(f"Failed to notify expired session of {session.owner}: {e!r}")
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            self._wake.clear()
+            self.expire()
+            await self._notify()
+            # Woken early to tell the users of evicted sessions
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wake.wait(), self.sweep_interval)
+
+    async def start(self) -> None:
+        # Async, so nonebot runs it on the event loop instead of a worker thread
+        if self._sweep_task is None:
+            self._wake = asyncio.Event()
+            self._sweep_task = asyncio.get_running_loop().create_task(self._sweep_loop())
+
+    async def stop(self) -> None:
+        if self._sweep_task is not None:
+            self._sweep_task.cancel()
+            self._sweep_task = None
+            self._wake = None
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            'active': len(self._sessions),
+            'bytes': self._bytes,
+            'created': self.created,
+            'resumed': self.resumed,
+            'expired': self.expired,
+            'evicted': self.evicted,
+        }
+
+
+sessions = SessionStore()
+
+try:
+    get_driver().on_startup(sessions.start)
+    get_driver().on_shutdown(sessions.stop)
+except ValueError:
+    logger.warning("NoneBot is not initialized, expired sessions will not be swept")
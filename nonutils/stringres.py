@@ -1,5 +1,19 @@
+import json
+import time
+from datetime import datetime
+from pathlib import Path
+from string import Formatter
+from typing import Dict, Optional, Tuple
+
+from loguru import logger
+from nonebot.adapters import Event
 from pydantic import BaseSettings
 
+from nonutils.lazy import LazyObject
+from nonutils.persistent import Preference
+
+locale_dir: Path = Path("locales")
+
 FULL_SPACE = '　'  # \u3000，全角空格
 
 EMOJI_WARNING = '⚠'
@@ -12,6 +26,9 @@ class StringRes(BaseSettings):
     MSG_UNKNOWN_CMD = "未知命令 '{cmd}'。\n" \
                       "请使用 '/help' 获取可用命令列表。"
 
+    MSG_UNKNOWN_CMD_SUGGEST = "未知命令 '{cmd}'。\n" \
+                              "您是否想查看：{suggestions}"
+
     MSG_MAIN_USAGE_DOC = "使用帮助\n\n" \
                          "► 命令列表\n{cmd_list}\n\n" \
                          "► 使用说明\n" \
@@ -25,11 +42,38 @@ class StringRes(BaseSettings):
                                 "► 说明文档\n{doc}\n\n" \
                                 "► 使用方式\n{switch_list}"
 
+    MSG_CMD_COOLDOWN = "命令冷却中，请在 {remaining} 秒后重试。"
+    MSG_CMD_BUSY = "命令繁忙，请稍后重试。"
+    MSG_SESSION_EXPIRED = "会话已超时，请重新发送命令。"
+
+    MSG_STATS = "运行统计\n\n► 调用次数 / 错误次数 / P95 延迟\n{stats_list}\n\n" \
+                "► 多轮会话\n" \
+                + FULL_SPACE + "活跃 {active}，已恢复 {resumed}，超时 {expired}，被淘汰 {evicted}"
+
+    MSG_TRACE = "错误追踪\n\n► 最近的错误（{failures} 次，{signatures} 种签名）\n{failure_list}\n\n" \
+                "► 使用说明\n" \
+                + FULL_SPACE + "» /trace <签名|追踪ID>\n" \
+                + FULL_SPACE + "显示该错误的详细信息。"
+
+    MSG_TRACE_DETAIL = "错误 {signature}\n\n" \
+                       "► 来源\n{source}\n\n" \
+                       "► 错误\n{error}\n\n" \
+                       "► 次数\n{count} 次，首次于 {first_seen}，最近于 {last_seen}\n\n" \
+                       "► 最近的追踪ID\n{trace_ids}\n\n" \
+                       "► 调用栈\n{stack}"
+
+    MSG_TRACE_NOT_FOUND = "未找到签名或追踪ID '{key}'。"
+
     EXPR_NOT_AVAILABLE = "（无可用信息）"
     EXPR_NO_CMDS = "（无可用命令）"
 
     FORMAT_CMDS_LIST = FULL_SPACE + "» {cmd}" + FULL_SPACE + "{desc}"
     FORMAT_SWITCHES_LIST = FULL_SPACE + "» {usage}"
+    FORMAT_STATS_LIST = FULL_SPACE + "» {name}" + FULL_SPACE + "{calls} / {errors} / {p95:.0f}ms"
+    FORMAT_TRACE_LIST = FULL_SPACE + "» {signature}" + FULL_SPACE + "{count} 次，最近于 {last_seen}\n" \
+                        + FULL_SPACE * 2 + "{source}: {error}"
+    FORMAT_SUGGESTION = "'/help {name}'"
+    FORMAT_HELP_PAGE = "\n第 {page}/{total} 页，使用 '/help <页码>' 翻页。"
 
     FORMAT_BASIC_MSG = " <{cmd}>: {msg}"  # {time} -> %H:%M
     FORMAT_SUCCESS_MSG = EMOJI_SUCCEED + FORMAT_BASIC_MSG
@@ -38,4 +82,120 @@ class StringRes(BaseSettings):
     FORMAT_QUESTION_MSG = EMOJI_QUESTION + FORMAT_BASIC_MSG
 
 
-Rstr = StringRes()
+# fmt -> (second, formatted time)
+_now_cache: Dict[str, Tuple[int, str]] = {}
+
+
+def format_now(fmt: str = '%H:%M') -> str:
+    """`datetime.now().strftime(fmt)`, computed at most once per second."""
+    tick = int(time.time())
+    cached = _now_cache.get(fmt)
+    if cached is None or cached[0] != tick:
+        cached = _now_cache[fmt] = (tick, datetime.now().strftime(fmt))
+    return cached[1]
+
+
+class Template(str):
+    """A string resource parsed once, so formatting fills `{time}` only if the template uses it."""
+
+    def __new__(cls, value: str):
+        self = super().__new__(cls, value)
+        self.fields = frozenset(name for _, name, _, _ in Formatter().parse(value) if name)
+        return self
+
+    def format(self, *args, **kwargs) -> str:
+        if 'time' in self.fields and 'time' not in kwargs:
+            kwargs['time'] = format_now()
+        return str.format(self, *args, **kwargs)
+
+
+class Strings:
+    """The string resources of a locale, with the fields of `StringRes` as `Template`s."""
+
+    def __init__(self, locale: str, res: StringRes):
+        self.locale = locale
+        for name, value in res:
+            setattr(self, name, Template(value) if isinstance(value, str) else value)
+
+    def __repr__(self) -> str:
+        return f'<Strings {self.locale}>'
+
+
+class LocalePreference(Preference):
+    # group id -> locale of the group
+    groups: Dict[str, str] = {}
+
+
+class StringResManager:
+    """Load string resource packs per locale, and choose the locale of each group.
+
+    A pack is a JSON file `locale_dir/<locale>.json` mapping fields of `StringRes` to their translation,
+    fields missing from it keep the built-in strings. A pack is loaded and its templates parsed on first use
+    of its locale, then kept, so picking the strings of an event is a couple of dict lookups.
+    Locales of groups are saved in the `locale` preference.
+    """
+
+    def __init__(self, default_locale: str = 'zh_CN', pref_name: str = 'locale'):
+        self.default_locale = default_locale
+        self.pref_name = pref_name
+
+        self._strings: Dict[str, Strings] = {}
+        self._pref: Optional[LocalePreference] = None
+
+    def _load_pack(self, locale: str) -> Dict[str, str]:
+        path = locale_dir / f'{locale}.json'
+        if not path.is_file():
+            if locale != self.default_locale:
+                logger.warning(f"No string resource pack for locale {locale}, using the built-in strings")
+            return {}
+        pack = json.loads(path.read_text(encoding='utf-8'))
+        unknown = pack.keys() - StringRes.__fields__.keys()
+        if unknown:
+            logger.warning(f"Ignored unknown strings in resource pack {path}: {', '.join(sorted(unknown))}")
+        return {k: v for k, v in pack.items() if k not in unknown}
+
+    def get(self, locale: Optional[str] = None) -> Strings:
+        """Strings of `locale` (the default locale if None), loading its pack on first use."""
+        locale = locale or self.default_locale
+        strings = self._strings.get(locale)
+        if strings is None:
+            strings = self._strings[locale] = Strings(locale, StringRes(**self._load_pack(locale)))
+        return strings
+
+    def load(self) -> LocalePreference:
+        if self._pref is None:
+            self._pref = LocalePreference(self.pref_name)
+        return self._pref
+
+    def get_locale(self, event: Optional[Event] = None) -> str:
+        """Locale of the group of `event` (the event being handled if None)."""
+        if event is None:
+            from nonebot.matcher import current_event
+            event = current_event.get(None)
+        group_id = getattr(event, 'group_id', None)
+        if group_id is None:
+            return self.default_locale
+        return self.load().groups.get(str(group_id), self.default_locale)
+
+    def set_group_locale(self, group_id, locale: Optional[str]) -> None:
+        """Set the locale of group `group_id`, None for the default locale."""
+        pref = self.load()
+        if locale is None:
+            pref.groups.pop(str(group_id), None)
+        else:
+            pref.groups[str(group_id)] = locale
+        pref._mark_dirty()
+
+    def for_event(self, event: Optional[Event] = None) -> Strings:
+        """Strings in the locale of the group of `event` (the event being handled if None)."""
+        return self.get(self.get_locale(event))
+
+    def reload(self) -> None:
+        """Drop the loaded packs, they are read again on next use."""
+        self._strings.clear()
+
+
+strings = StringResManager()
+
+# Strings of the default locale, loaded on first use
+Rstr: Strings = LazyObject(strings.get)  # type: ignore
@@ -0,0 +1,165 @@
+import itertools
+import os
+import time
+import weakref
+import zlib
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, Iterator, List, Optional
+
+from loguru import logger
+from nonebot.matcher import Matcher, current_matcher
+
+_trace_id: ContextVar[Optional[str]] = ContextVar('nonutils_trace_id', default=None)
+
+
+def _stack_of(exc: BaseException, max_depth: int) -> List[str]:
+    """Frames of the traceback of `exc`, innermost last, without reading source files."""
+    frames = []
+    tb = exc.__traceback__
+    while tb is not None:
+        code = tb.tb_frame.f_code
+        frames.append(f"{code.co_filename}:{tb.tb_lineno}:{code.co_name}")
+        tb = tb.tb_next
+    return frames[-max_depth:]
+
+
+class Failure:
+    __slots__ = ('time', 'source', 'trace_id', 'signature', 'error')
+
+    def __init__(self, source: str, trace_id: Optional[str], signature: str, error: str):
+        self.time = time.time()
+        self.source = source
+        self.trace_id = trace_id
+        self.signature = signature
+        self.error = error
+
+
+class Signature:
+    """Failures of the same source, exception type and stack, counted once."""
+    __slots__ = ('signature', 'source', 'error', 'stack', 'count', 'first_seen', 'last_seen', 'trace_ids',
+                 'logged_at', 'suppressed')
+
+    def __init__(self, signature: str, source: str, error: str, stack: List[str]):
+        self.signature = signature
+        self.source = source
+        self.error = error
+        self.stack = stack
+        self.count = 0
+        self.first_seen = self.last_seen = time.time()
+        self.trace_ids: Deque[str] = deque(maxlen=5)
+        self.logged_at: Optional[float] = None
+        self.suppressed = 0
+
+
+class Tracer:
+    """Correlation IDs of handled events, and a bounded record of recent failures.
+
+    Every run of a matcher gets a trace ID, sent as `X-Request-ID` by the API calls it makes.
+    nonebot runs preprocessors in their own tasks, so the ID is kept per matcher and found through
+    its `current_matcher`; use `bind` to set one for work outside of matchers.
+
+    Failures are kept in a ring of the last `max_failures`, and grouped by a signature of their source,
+    exception type and stack, keeping the last `max_signatures`. A signature is logged with its traceback
+    the first time, then at most once every `log_interval` seconds with the number of failures suppressed.
+    Nothing is done on the success path but getting the ID.
+    """
+
+    def __init__(self, max_failures: int = 256, max_signatures: int = 128, max_depth: int = 16,
+                 log_interval: float = 60.):
+        self.max_signatures = max_signatures
+        self.max_depth = max_depth
+        self.log_interval = log_interval
+
+        self.failures: Deque[Failure] = deque(maxlen=max_failures)
+        self.signatures: 'OrderedDict[str, Signature]' = OrderedDict()
+
+        self._ids: 'weakref.WeakKeyDictionary[Matcher, str]' = weakref.WeakKeyDictionary()
+        # Unique within the process, the prefix tells processes apart
+        self._prefix = os.urandom(3).hex()
+        self._counter = itertools.count(1)
+
+    def new_id(self) -> str:
+        return f'{self._prefix}-{next(self._counter):x}'
+
+    def begin(self, matcher: Matcher) -> str:
+        """Give the run of `matcher` a new trace ID."""
+        trace_id = self._ids[matcher] = self.new_id()
+        return trace_id
+
+    def get_id(self) -> Optional[str]:
+        """Trace ID of the current context or matcher, None outside of both."""
+        trace_id = _trace_id.get()
+        if trace_id is None:
+            matcher = current_matcher.get(None)
+            if matcher is not None:
+                trace_id = self._ids.get(matcher)
+        return trace_id
+
+    @contextmanager
+    def bind(self, trace_id: Optional[str] = None) -> Iterator[str]:
+        """Set the trace ID (a new one if None) of the code in the block and of the tasks it starts."""
+        token = _trace_id.set(trace_id or self.new_id())
+        try:
+            yield _trace_id.get()
+        finally:
+            _trace_id.reset(token)
+
+    def record(self, source: str, exc: BaseException, log: bool = True) -> Signature:
+        """Record a failure of `source` (e.g. `cmd:help`, `api:<url>`), logging it unless `log` is False."""
+        stack = _stack_of(exc, self.max_depth)
+        key = f"{zlib.crc32(' '.join([source, type(exc).__qualname__, *stack]).encode()):08x}"
+        error = f"{type(exc).__name__}: {exc}" if str(exc) else type(exc).__name__
+        trace_id = self.get_id()
+
+        sig = self.signatures.get(key)
+        if sig is None:
+            sig = self.signatures[key] = Signature(key, source, error, stack)
+            while len(self.signatures) > self.max_signatures:
+                self.signatures.popitem(last=False)
+        else:
+            self.signatures.move_to_end(key)
+            sig.error = error
+            sig.last_seen = time.time()
+        sig.count += 1
+        if trace_id is not None:
+            sig.trace_ids.append(trace_id)
+        self.failures.append(Failure(source, trace_id, key, error))
+
+        if log:
+            now = time.monotonic()
+            if sig.logged_at is None:
+                sig.logged_at = now
+                logger.opt(exception=exc).warning(f"{source} failed [{key}, trace {trace_id}]: {error}")
+            elif now - sig.logged_at >= self.log_interval:
+                sig.logged_at = now
+                logger.warning(f"{source} failed [{key}, trace {trace_id}]: {error}"
+                               f" ({sig.suppressed} similar failures not logged)")
+                sig.suppressed = 0
+            else:
+                sig.suppressed += 1
+        return sig
+
+    def find(self, key: str) -> Optional[Signature]:
+        """Signature `key`, or the signature of the last failure with trace ID `key`."""
+        sig = self.signatures.get(key)
+        if sig is None:
+            failure = next((f for f in reversed(self.failures) if f.trace_id == key), None)
+            if failure is not None:
+                sig = self.signatures.get(failure.signature)
+        return sig
+
+    def top(self, n: int = 10) -> List[Signature]:
+        """The `n` signatures seen the most."""
+        return sorted(self.signatures.values(), key=lambda s: (s.count, s.last_seen), reverse=True)[:n]
+
+    def get_stats(self) -> Dict[str, int]:
+        return {'failures': len(self.failures), 'signatures': len(self.signatures)}
+
+    def reset(self) -> None:
+        self.failures.clear()
+        self.signatures.clear()
+
+
+tracer = Tracer()
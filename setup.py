@@ -24,7 +24,7 @@ VERSION = None
 
 # What packages are required for this module to be executed?
 REQUIRED = [
-    'nonebot2',
+    'nonebot2>=2.0.0',
     'loguru',
     'pydantic'
 ]
@@ -32,6 +32,8 @@ REQUIRED = [
 # What packages are optional?
 EXTRAS = {
     # 'fancy feature': ['django'],
+    'fastjson': ['orjson'],
+    'stream': ['ijson'],
 }
 
 # The rest you shouldn't have to touch too much :)
@@ -107,7 +109,7 @@ setup(
     author_email=EMAIL,
     python_requires=REQUIRES_PYTHON,
     url=URL,
-    packages=find_packages(exclude=["tests", "*.tests", "*.tests.*", "tests.*"]),
+    packages=find_packages(exclude=["tests", "*.tests", "*.tests.*", "tests.*", "benchmarks", "benchmarks.*"]),
     # If your package is a single module, use this instead of 'packages':
     # py_modules=['mypackage'],
 
@@ -0,0 +1,96 @@
+"""nonebot with the `none` driver, a minimal in-memory adapter, and preferences kept in a temporary directory."""
+from typing import Iterable, List, Optional
+
+import nonebot
+import pytest
+from nonebot.adapters import Adapter, Bot, Event, Message, MessageSegment
+
+nonebot.init(driver='~none', log_level='WARNING')
+
+import nonutils.persistent  # noqa: E402
+
+
+class FakeMessageSegment(MessageSegment):
+    @classmethod
+    def get_message_class(cls):
+        return FakeMessage
+
+    def __str__(self) -> str:
+        return self.data['text'] if self.is_text() else f'[{self.type}]'
+
+    def is_text(self) -> bool:
+        return self.type == 'text'
+
+
+class FakeMessage(Message):
+    @classmethod
+    def get_segment_class(cls):
+        return FakeMessageSegment
+
+    @staticmethod
+    def _construct(msg: str) -> Iterable[FakeMessageSegment]:
+        yield FakeMessageSegment('text', {'text': msg})
+
+
+class FakeEvent(Event):
+    text: str
+    user_id: str = 'user'
+    group_id: Optional[str] = None
+
+    def get_type(self) -> str:
+        return 'message'
+
+    def get_event_name(self) -> str:
+        return 'message'
+
+    def get_event_description(self) -> str:
+        return self.text
+
+    def get_user_id(self) -> str:
+        return self.user_id
+
+    def get_session_id(self) -> str:
+        return f'{self.group_id}_{self.user_id}'
+
+    def get_message(self) -> FakeMessage:
+        return FakeMessage(self.text)
+
+    def is_tome(self) -> bool:
+        return True
+
+
+class FakeAdapter(Adapter):
+    @classmethod
+    def get_name(cls) -> str:
+        return 'fake'
+
+    async def _call_api(self, bot: Bot, api: str, **data):
+        return None
+
+
+class FakeBot(Bot):
+    """Keeps the text of the messages sent."""
+
+    def __init__(self, adapter: Adapter, self_id: str):
+        super().__init__(adapter, self_id)
+        self.sent: List[str] = []
+
+    async def send(self, event: Event, message, **kwargs):
+        self.sent.append(str(message))
+
+
+@pytest.fixture(autouse=True)
+def pref_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(nonutils.persistent, 'pref_dir', tmp_path)
+    yield tmp_path
+    nonutils.persistent.pref_writer.flush()
+
+
+@pytest.fixture
+def bot() -> FakeBot:
+    return FakeBot(FakeAdapter(nonebot.get_driver()), 'bot')
+
+
+@pytest.fixture
+def make_event():
+    return FakeEvent
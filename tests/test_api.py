@@ -0,0 +1,184 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from nonutils.apimgr import API, ApiStatusError, ApiUnavailableError, apimgr
+from nonutils.breaker import CircuitBreaker
+
+
+class Upstream:
+    """Local server answering with `statuses` in turn, then the last one, after `delays` in turn."""
+
+    def __init__(self, statuses=(200,), delays=(0.,)):
+        self.statuses = list(statuses)
+        self.delays = list(delays)
+        self.hits = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        hit = self.hits
+        self.hits += 1
+        await asyncio.sleep(self.delays[min(hit, len(self.delays) - 1)])
+        status = self.statuses[min(hit, len(self.statuses) - 1)]
+        return web.json_response({'hit': hit}, status=status)
+
+
+class ProbedApi(API):
+    async def test(self) -> bool:
+        return await self.request() is not None
+
+
+@asynccontextmanager
+async def serve(upstream: Upstream):
+    app = web.Application()
+    app.router.add_route('*', '/', upstream.handle)
+    server = TestServer(app)
+    await server.start_server()
+    apis = set(apimgr.apis)
+    try:
+        yield str(server.make_url('/'))
+    finally:
+        apimgr.apis &= apis
+        await apimgr.close()
+        await server.close()
+
+
+@pytest.fixture(autouse=True)
+def _no_jitter(monkeypatch):
+    monkeypatch.setattr(apimgr, 'health_check_jitter', 0.)
+
+
+def test_breaker_states():
+    breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    time.sleep(0.06)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    time.sleep(0.06)
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_only_server_failures_open_breaker():
+    async def main(status):
+        async with serve(Upstream([status])) as url:
+            api = ProbedApi(url, proxy=None, failure_threshold=1)
+            with pytest.raises(ApiStatusError):
+                await api.request()
+            return api.breaker.state
+
+    assert asyncio.run(main(404)) == CircuitBreaker.CLOSED
+    assert asyncio.run(main(429)) == CircuitBreaker.OPEN
+    assert asyncio.run(main(503)) == CircuitBreaker.OPEN
+
+
+def test_health_check_closes_open_breaker():
+    async def main():
+        upstream = Upstream([503, 200])
+        async with serve(upstream) as url:
+            api = ProbedApi(url, proxy=None, failure_threshold=1, recovery_timeout=60.)
+            with pytest.raises(ApiStatusError):
+                await api.request()
+            with pytest.raises(ApiUnavailableError):
+                await api.request()
+
+            await apimgr.check_health()
+            assert api.breaker.state == CircuitBreaker.CLOSED
+            assert (await api.request())['hit'] == 2
+
+    asyncio.run(main())
+
+
+def test_health_check_skips_cache():
+    async def main():
+        async with serve(Upstream([200, 503])) as url:
+            api = ProbedApi(url, proxy=None, cache_ttl=60., failure_threshold=1, recovery_timeout=60.)
+            await api.request()
+            await apimgr.check_health()
+            assert api.breaker.state == CircuitBreaker.OPEN
+
+    asyncio.run(main())
+
+
+def test_disabled_api_is_not_probed_into_failure():
+    async def main():
+        async with serve(Upstream()) as url:
+            api = ProbedApi(url, proxy=None, disable=True, failure_threshold=1)
+            await apimgr.check_health()
+            assert api.breaker.failures == 0
+
+    asyncio.run(main())
+
+
+def test_transient_failures_are_retried():
+    async def main():
+        upstream = Upstream([503, 502, 200])
+        async with serve(upstream) as url:
+            api = ProbedApi(url, proxy=None, retries=2, retry_backoff=0.01)
+            assert (await api.request())['hit'] == 2
+
+            # Not idempotent
+            upstream.hits = 0
+            with pytest.raises(ApiStatusError):
+                await api.request('POST', {'a': 1})
+            assert upstream.hits == 1
+
+    asyncio.run(main())
+
+
+def test_client_errors_are_not_retried():
+    async def main():
+        upstream = Upstream([404, 200])
+        async with serve(upstream) as url:
+            api = ProbedApi(url, proxy=None, retries=3, retry_backoff=0.01)
+            with pytest.raises(ApiStatusError):
+                await api.request()
+            assert upstream.hits == 1
+
+    asyncio.run(main())
+
+
+def test_retries_give_up_after_last_attempt():
+    async def main():
+        upstream = Upstream([503])
+        async with serve(upstream) as url:
+            api = ProbedApi(url, proxy=None, retries=2, retry_backoff=0.01)
+            with pytest.raises(ApiStatusError):
+                await api.request()
+            assert upstream.hits == 3
+
+    asyncio.run(main())
+
+
+def test_slow_call_is_hedged():
+    async def main():
+        upstream = Upstream(delays=[1., 0.])
+        async with serve(upstream) as url:
+            api = ProbedApi(url, proxy=None, hedge=True, hedge_delay=0.05)
+            start = time.monotonic()
+            resp = await api.request()
+            return resp, time.monotonic() - start, upstream.hits
+
+    resp, elapsed, hits = asyncio.run(main())
+    assert resp['hit'] == 1 and hits == 2
+    assert elapsed < 0.5
+
+
+def test_fast_call_is_not_hedged():
+    async def main():
+        upstream = Upstream()
+        async with serve(upstream) as url:
+            api = ProbedApi(url, proxy=None, hedge=True, hedge_delay=0.5)
+            await api.request()
+            return upstream.hits
+
+    assert asyncio.run(main()) == 1
@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+from nonebot.matcher import Matcher
+from nonebot.message import handle_event
+
+import nonutils.command
+from nonutils.command import CmdManager, Command
+
+
+@pytest.fixture
+def manager(monkeypatch) -> CmdManager:
+    manager = CmdManager()
+    monkeypatch.setattr(nonutils.command, 'cmdmgr', manager)
+    return manager
+
+
+def test_deferred_command_works_once_registered(manager, bot, make_event):
+    manager.defer_registration()
+    later = Command('later')
+
+    @later.got('x', prompt='x?')
+    async def _(matcher: Matcher):
+        await matcher.send(f"got {matcher.state['x']}")
+
+    assert later.matcher not in manager.owners
+
+    async def main():
+        await manager.register_pending()
+        await handle_event(bot, make_event(text='/later'))
+        await handle_event(bot, make_event(text='1'))
+
+    asyncio.run(main())
+    assert manager.owners[later.matcher] is later
+    assert bot.sent == ['x?', 'got 1']
+
+
+def test_defer_registration_falls_back_with_other_nonebot_versions(manager, monkeypatch):
+    monkeypatch.setattr(nonutils.command, '_CAN_DEFER', False)
+    manager.defer_registration()
+    now = Command('now')
+    assert manager.owners[now.matcher] is now
+
+    created = manager.bulk_register([{'cmd': 'bulk1'}, {'cmd': 'bulk2'}])
+    assert all(manager.owners[cmd.matcher] is cmd for cmd in created)
+
+
+@pytest.mark.parametrize('can_defer, use_dispatcher', [(True, False), (False, False), (False, True)])
+def test_failed_bulk_register_registers_nothing(manager, monkeypatch, bot, make_event, can_defer, use_dispatcher):
+    monkeypatch.setattr(nonutils.command, '_CAN_DEFER', can_defer)
+    if use_dispatcher:
+        manager.use_dispatcher()
+    # Distinct names, as matchers of previous runs stay in nonebot
+    name = f'bulk{can_defer:d}{use_dispatcher:d}_'
+    specs = [{'cmd': name + '1'}, {'cmd': name + '2', 'aliases': {'second'}},
+             {'cmd': name + '3', 'cooldown_scope': 'bogus'}]
+    with pytest.raises(ValueError):
+        manager.bulk_register(specs)
+    assert not manager.commands and not manager.names and not manager.owners
+    assert manager.suggest('second') == []
+
+    async def main():
+        await handle_event(bot, make_event(text=f'/{name}1'))
+
+    asyncio.run(main())
+    assert not bot.sent
+
+    specs[2]['cooldown_scope'] = 'group'
+    created = manager.bulk_register(specs)
+    for cmd in created:
+        cmd.handle()(_reply)
+    asyncio.run(main())
+    assert bot.sent == ['ok']
+
+
+async def _reply(matcher: Matcher):
+    await matcher.send('ok')
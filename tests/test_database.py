@@ -0,0 +1,77 @@
+import asyncio
+import sqlite3
+
+from nonutils.database import Database
+
+
+def _make_db(path) -> Database:
+    db = Database(path, batch_delay=0.05)
+    conn = sqlite3.connect(str(path))
+    conn.execute('CREATE TABLE a__log (id INTEGER PRIMARY KEY, msg TEXT NOT NULL)')
+    conn.execute('CREATE TABLE b__log (id INTEGER PRIMARY KEY, msg TEXT NOT NULL)')
+    conn.close()
+    return db
+
+
+def test_failing_table_does_not_lose_other_rows(tmp_path):
+    db = _make_db(tmp_path / 'test.db')
+
+    async def main():
+        a, b = db.namespace('a'), db.namespace('b')
+        a.insert_later('log', {'msg': 'kept'})
+        b.insert_later('missing', {'msg': 'lost'})
+        b.insert_later('log', {'mesage': 'lost'})
+        b.insert_later('log', {'msg': 'kept too'})
+        await db.flush()
+        rows = [*await a.fetchall('SELECT msg FROM {log}'), *await b.fetchall('SELECT msg FROM {log}')]
+        await db.close()
+        return [row['msg'] for row in rows]
+
+    assert asyncio.run(main()) == ['kept', 'kept too']
+
+
+def test_constraint_violation_drops_only_failing_rows(tmp_path):
+    db = _make_db(tmp_path / 'test.db')
+
+    async def main():
+        a = db.namespace('a')
+        for i, msg in enumerate(['first', None, 'third']):
+            a.insert_later('log', {'id': i, 'msg': msg})
+        a.insert_later('log', {'id': 0, 'msg': 'duplicated'})
+        await db.flush()
+        rows = await a.fetchall('SELECT msg FROM {log} ORDER BY id')
+        await db.close()
+        return [row['msg'] for row in rows]
+
+    assert asyncio.run(main()) == ['first', 'third']
+
+
+def test_locked_rows_are_written_later(tmp_path, monkeypatch):
+    path = tmp_path / 'test.db'
+    db = _make_db(path)
+    connect = Database._connect
+
+    def connect_no_wait(self):
+        conn = connect(self)
+        conn.execute('PRAGMA busy_timeout = 0')
+        return conn
+
+    monkeypatch.setattr(Database, '_connect', connect_no_wait)
+
+    async def main():
+        a = db.namespace('a')
+        locker = sqlite3.connect(str(path), isolation_level=None)
+        locker.execute('BEGIN IMMEDIATE')
+        a.insert_later('log', {'msg': 'first'})
+        await db.flush()
+        a.insert_later('log', {'msg': 'second'})
+        assert db._pending_count == 2
+
+        locker.execute('COMMIT')
+        locker.close()
+        await asyncio.sleep(0.2)
+        rows = await a.fetchall('SELECT msg FROM {log} ORDER BY id')
+        await db.close()
+        return [row['msg'] for row in rows]
+
+    assert asyncio.run(main()) == ['first', 'second']
@@ -0,0 +1,59 @@
+import asyncio
+
+from nonebot.adapters import Event
+from nonebot.exception import IgnoredException
+from nonebot.message import handle_event, run_preprocessor
+
+from nonutils.command import Command
+
+heavy = Command('heavy', max_concurrency=1)
+replies = []
+
+
+@heavy.handle()
+async def _():
+    replies.append('ok')
+
+
+@run_preprocessor
+async def _blacklist(event: Event):
+    if event.get_user_id() == 'blocked':
+        raise IgnoredException('blacklisted')
+
+
+def test_slot_released_when_another_preprocessor_ignores(bot, make_event):
+    async def main():
+        await handle_event(bot, make_event(text='/heavy', user_id='blocked'))
+        for _ in range(3):
+            await handle_event(bot, make_event(text='/heavy'))
+
+    asyncio.run(main())
+    assert replies == ['ok'] * 3
+    assert not bot.sent
+    assert not heavy._semaphore.locked()
+
+
+slow = Command('slow', max_concurrency=1, cooldown=60)
+gate = []
+
+
+@slow.handle()
+async def _():
+    await gate[0].wait()
+    replies.append('slow')
+
+
+def test_busy_call_does_not_start_cooldown(bot, make_event):
+    async def main():
+        gate.append(asyncio.Event())
+        first = asyncio.ensure_future(handle_event(bot, make_event(text='/slow', user_id='a')))
+        await asyncio.sleep(0.05)
+        await handle_event(bot, make_event(text='/slow', user_id='b'))
+        gate[0].set()
+        await first
+        await handle_event(bot, make_event(text='/slow', user_id='b'))
+
+    replies.clear()
+    asyncio.run(main())
+    assert len(bot.sent) == 1 and '繁忙' in bot.sent[0]
+    assert replies == ['slow', 'slow']
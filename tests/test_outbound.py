@@ -0,0 +1,46 @@
+import asyncio
+
+from nonebot.matcher import current_bot, current_event
+
+from nonutils.outbound import OutboundQueue
+
+
+def test_idle_chat_buckets_are_dropped(bot, make_event):
+    outbound = OutboundQueue(merge_window=0., chat_rate=20., chat_burst=2, bot_rate=1000., bot_burst=100)
+
+    async def send(group_id: str, text: str):
+        current_bot.set(bot)
+        current_event.set(make_event(text='', group_id=group_id))
+        await outbound.put(text)
+
+    async def main():
+        await asyncio.gather(*(send(str(i), f'hello {i}') for i in range(50)))
+        await asyncio.sleep(0.01)
+        assert len(outbound._chat_buckets) == 50
+        await outbound.close()
+        await asyncio.sleep(0.2)
+
+    asyncio.run(main())
+    assert len(bot.sent) == 50
+    assert not outbound._chat_buckets and not outbound._bot_buckets
+
+
+def test_chat_rate_holds_across_bursts(bot, make_event):
+    outbound = OutboundQueue(merge_window=0., chat_rate=10., chat_burst=1)
+
+    async def send(text: str):
+        current_bot.set(bot)
+        current_event.set(make_event(text='', group_id='1'))
+        await outbound.put(text)
+        await outbound.close()
+
+    async def main():
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        for i in range(3):
+            await send(str(i))
+        return loop.time() - start
+
+    # The bucket of the chat is kept while refilling, so the second and third sends wait for it
+    assert asyncio.run(main()) >= 0.18
+    assert bot.sent == ['0', '1', '2']
@@ -0,0 +1,82 @@
+import threading
+
+import nonutils.persistent
+from nonutils.persistent import Preference, ScopedPreference, ScopedPreferenceStore, pref_writer
+
+
+class CounterPref(Preference):
+    n: int = 0
+
+
+def test_unchanged_preference_is_not_written(pref_dir, monkeypatch):
+    writes = []
+    write = nonutils.persistent.atomic_write_text
+
+    def counted_write(path, text):
+        writes.append(path)
+        write(path, text)
+
+    monkeypatch.setattr(nonutils.persistent, 'atomic_write_text', counted_write)
+
+    for _ in range(3):
+        CounterPref('counter')
+    pref_writer.flush()
+    assert not writes
+    assert not (pref_dir / 'counter.json').exists()
+
+    pref = CounterPref('counter')
+    pref.n = 1
+    assert CounterPref('counter').n == 1
+    pref_writer.flush()
+    assert writes == [pref_dir / 'counter.json']
+
+
+class CounterScope(ScopedPreference):
+    n: int = 0
+
+
+class _BlockingConn:
+    """Wraps a connection, blocking writes until `release` is set."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __enter__(self):
+        return self.conn.__enter__()
+
+    def __exit__(self, *exc_info):
+        return self.conn.__exit__(*exc_info)
+
+    def execute(self, *args):
+        return self.conn.execute(*args)
+
+    def executemany(self, *args):
+        self.started.set()
+        self.release.wait(5)
+        return self.conn.executemany(*args)
+
+
+def test_scope_read_during_flush_sees_unsaved_value(pref_dir):
+    store = ScopedPreferenceStore(CounterScope, 'counter', db_path=pref_dir / 'scoped.db',
+                                  cache_size=1, flush_delay=60.)
+    store['a'].n = 1
+    store.flush()
+
+    store['a'].n = 2
+    conn = store._conn = _BlockingConn(store._conn)
+    flushing = threading.Thread(target=store.flush)
+    flushing.start()
+    assert conn.started.wait(5)
+
+    # Evicted from the cache, and not dirty anymore while its row is being written
+    store['b']
+    assert store['a'].n == 2
+    conn.release.set()
+    flushing.join()
+
+    store['a'].n += 10
+    store.flush()
+    reopened = ScopedPreferenceStore(CounterScope, 'counter', db_path=pref_dir / 'scoped.db')
+    assert reopened['a'].n == 12
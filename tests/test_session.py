@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+from nonebot.matcher import Matcher
+from nonebot.message import handle_event
+
+from nonutils.command import Command
+from nonutils.session import sessions
+
+ask = Command('ask', session_ttl=0.2)
+
+
+@ask.got('x', prompt='which x?')
+@ask.got('y', prompt='which y?')
+async def _(matcher: Matcher):
+    await matcher.send(f"got {matcher.state['x']} {matcher.state['y']}")
+
+
+@pytest.fixture
+def sweeper(monkeypatch):
+    monkeypatch.setattr(sessions, 'sweep_interval', 0.05)
+
+    async def run(main):
+        await sessions.start()
+        try:
+            return await main
+        finally:
+            await sessions.stop()
+
+    return run
+
+
+def test_session_is_tracked_until_finished(bot, make_event):
+    async def main():
+        created, resumed = sessions.created, sessions.resumed
+        await handle_event(bot, make_event(text='/ask'))
+        assert len(sessions) == 1
+        await handle_event(bot, make_event(text='1'))
+        assert len(sessions) == 1
+        await handle_event(bot, make_event(text='2'))
+        assert len(sessions) == 0
+        assert (sessions.created - created, sessions.resumed - resumed) == (2, 2)
+
+    asyncio.run(main())
+    assert bot.sent == ['which x?', 'which y?', 'got 1 2']
+
+
+def test_expired_session_is_ended_by_sweeper(bot, make_event, sweeper):
+    async def main():
+        expired = sessions.expired
+        await handle_event(bot, make_event(text='/ask'))
+        await asyncio.sleep(0.4)
+        assert len(sessions) == 0 and sessions.expired == expired + 1
+
+        # Not continued anymore
+        await handle_event(bot, make_event(text='1'))
+
+    asyncio.run(sweeper(main()))
+    assert len(bot.sent) == 2 and bot.sent[0] == 'which x?'
+
+
+def test_evicted_session_is_notified_by_sweeper(bot, make_event, monkeypatch):
+    monkeypatch.setattr(sessions, 'max_sessions', 2)
+
+    async def main():
+        evicted = sessions.evicted
+        for user in 'abc':
+            await handle_event(bot, make_event(text='/ask', user_id=user))
+        assert len(sessions) == 2 and sessions.evicted == evicted + 1
+        # Not notified by the command which evicted it
+        assert bot.sent == ['which x?'] * 3
+
+        await sessions.start()
+        await asyncio.sleep(0.01)
+        await sessions.stop()
+        assert len(bot.sent) == 4
+        for user in 'bc':
+            await handle_event(bot, make_event(text='1', user_id=user))
+            await handle_event(bot, make_event(text='2', user_id=user))
+        assert len(sessions) == 0
+
+    asyncio.run(main())